@@ -2,17 +2,15 @@ from nwb_conversion_tools.basedatainterface import BaseDataInterface
 from nwb_conversion_tools.utils import get_schema_from_hdmf_class
 from nwb_conversion_tools.json_schema_utils import get_base_schema
 
+from jaeger_lab_to_nwb.resources.write_options import get_write_options_schema, get_write_options, wrap_data
+from jaeger_lab_to_nwb.resources.load_rsd.session_index import FRETSession, read_rsh
+from .rsddatachunkiterator import RSDDataChunkIterator, RSDPrefetcher
+
 from pynwb import NWBFile
 from pynwb.ophys import OpticalChannel
 from pynwb.device import Device
 from ndx_fret import FRET, FRETSeries
-from hdmf.data_utils import DataChunkIterator
-from datetime import datetime
-from pathlib import Path
 import pytz
-import numpy as np
-import struct
-import os
 
 
 class FRETDataInterface(BaseDataInterface):
@@ -46,17 +44,22 @@ class FRETDataInterface(BaseDataInterface):
             Device=get_schema_from_hdmf_class(Device),
             FRET=get_schema_from_hdmf_class(FRET)
         )
+
+        # Write options schema
+        metadata_schema['properties']['WriteOptions'] = get_base_schema()
+        metadata_schema['properties']['WriteOptions']['properties'] = {
+            'default': get_write_options_schema(),
+            self.__class__.__name__: get_write_options_schema()
+        }
         return metadata_schema
 
+    def get_session(self):
+        """Index of the trials of the session, parsed once from the .rsh headers and cached next to them."""
+        return FRETSession(self.source_data['dir_cortical_imaging'])
+
     def get_metadata(self):
         # Get session_start_time from first header file
-        dir_cortical_imaging = self.source_data['dir_cortical_imaging']
-        all_files = os.listdir(dir_cortical_imaging)
-        all_headers = [f for f in all_files if ('.rsh' in f) and ('_A' not in f) and ('_B' not in f)]
-        all_headers.sort()
-        _, _, acquisition_date, _, _ = self.read_trial_meta(trial_meta=Path(dir_cortical_imaging) / all_headers[0])
-        session_start_time = datetime.strptime(acquisition_date, '%Y/%m/%d %H:%M:%S')
-        session_start_time_tzaware = pytz.timezone('EST').localize(session_start_time)
+        session_start_time_tzaware = pytz.timezone('EST').localize(self.get_session().session_start_time)
 
         metadata = dict(
             NWBFile=dict(
@@ -66,33 +69,12 @@ class FRETDataInterface(BaseDataInterface):
         return metadata
 
     def read_trial_meta(self, trial_meta):
-        """Opens trial_meta file and read line by line."""
-        files_raw = []
-        addftolist = False
-        with open(trial_meta, "r") as f:
-            line = f.readline()
-            while line:
-                if 'acquisition_date' in line:
-                    acquisition_date = line.replace('acquisition_date', '').replace('=', '').strip()
-                if 'sample_time' in line:
-                    aux = line.replace('sample_time', '').replace('=', '').replace('msec', '').strip()
-                    sample_time = float(aux) / 1000.
-                    sample_rate = 1 / sample_time
-                if 'page_frames' in line:
-                    aux = line.replace('page_frames', '').replace('=', '').strip()
-                    n_frames = int(aux)
-                if addftolist:
-                    files_raw.append(line.strip())
-                if 'Data-File-List' in line:
-                    addftolist = True   # indicates that next lines are file names to be added
-                line = f.readline()
-
-        # Separate .rsm file (bitmap of monitor) from .rsd files (raw data)
-        file_rsm = files_raw[0]
-        files_raw = files_raw[1:]
-        return file_rsm, files_raw, acquisition_date, sample_rate, n_frames
+        """Reads trial_meta file: returns file_rsm, files_raw, acquisition_date, sample_rate, n_frames."""
+        meta = read_rsh(trial_meta)
+        return meta['file_rsm'], meta['files_raw'], meta['acquisition_date'], meta['sample_rate'], meta['n_frames']
 
-    def run_conversion(self, nwbfile: NWBFile, metadata: dict):
+    def run_conversion(self, nwbfile: NWBFile, metadata: dict, write_options: dict = None, num_workers: int = 1,
+                       max_pending_blocks: int = None):
         """
         Run conversionfor this data interface.
         Reads optophysiology raw data from .rsd files and adds it to nwbfile.
@@ -104,56 +86,23 @@ class FRETDataInterface(BaseDataInterface):
         ----------
         nwbfile : NWBFile
         metadata : dict
+        write_options : dict, optional
+            HDF5 chunking and compression options of the donor and acceptor frames, with keys chunk_shape,
+            compression ('gzip', 'lzf' or 'blosc'), compression_opts, shuffle and blosc_codec.
+            Overrides the options found in metadata['WriteOptions'].
+        num_workers : int, optional
+            Number of worker threads reading and decoding upcoming blocks of frames of the donor
+            and acceptor, and of the next trials, while the current ones are written.
+            By default, blocks are decoded one after another as they are written.
+        max_pending_blocks : int, optional
+            Maximum number of blocks (of about 100 MB) decoded ahead of the writer, to bound
+            the memory in use. By default, twice the number of workers.
         """
-        dir_cortical_imaging = self.source_data['dir_cortical_imaging']
-        ophys_list = [i.name for i in Path(dir_cortical_imaging).glob('*.rsh')]
-        if len(ophys_list) > 0:
-            fname_prefix = ophys_list[0].split('-')[0]
-        else:
-            raise OSError(f"No .rsd file found in directory: {dir_cortical_imaging}.\n"
-                          "Did you choose the correct path for source data?")
-
-        def data_gen(channel, trial):
-            """channel = 'A' or 'B'"""
-            # Read trial-specific metadata file .rsh
-            trial_meta = os.path.join(dir_cortical_imaging, f"{fname_prefix}-{trial}_{channel}.rsh")
-            file_rsm, files_raw, acquisition_date, sample_rate, n_frames = self.read_trial_meta(trial_meta=trial_meta)
-
-            # Iterates over all files within the same trial
-            for fn, fraw in enumerate(files_raw):
-                print('adding channel ' + channel + ', trial: ', trial, ': ', 100 * fn / len(files_raw), '%')
-                fpath = os.path.join(dir_cortical_imaging, fraw)
-
-                # Open file as a byte array
-                with open(fpath, "rb") as f:
-                    byte = f.read(1000000000)
-                # Data as word array: 'h' signed, 'H' unsigned
-                words = np.array(struct.unpack('h' * (len(byte) // 2), byte))
-
-                # Iterates over frames within the same file (n_frames, 100, 100)
-                n_frames = int(len(words) / 12800)
-                words_reshaped = words.reshape(12800, n_frames, order='F')
-                frames = np.zeros((n_frames, 100, 100))
-                excess_frames = np.zeros((n_frames, 20, 100))
-                for ifr in range(n_frames):
-                    iframe = -words_reshaped[:, ifr].reshape(128, 100, order='F').astype('int16')
-                    frames[ifr, :, :] = iframe[20:120, :]
-                    excess_frames[ifr, :, :] = iframe[0:20, :]
-
-                    yield iframe[20:120, :]
-
-                #     # Analog signals are taken from excess data variable
-                #     analog_1 = np.squeeze(np.squeeze(excess_frames[:, 12, 0:80:4]).reshape(20*256, 1))
-                #     analog_2 = np.squeeze(np.squeeze(excess_frames[:, 14, 0:80:4]).reshape(20*256, 1))
-                #     stim_trg = np.squeeze(np.squeeze(excess_frames[:, 8, 0:80:4]).reshape(20*256, 1))
+        write_options = get_write_options(metadata, self.__class__.__name__, write_options)
+        session = self.get_session()
 
         # Get session_start_time from first header file
-        all_files = os.listdir(dir_cortical_imaging)
-        all_headers = [f for f in all_files if ('.rsh' in f) and ('_A' not in f) and ('_B' not in f)]
-        all_headers.sort()
-        _, _, acquisition_date, _, _ = self.read_trial_meta(trial_meta=Path(dir_cortical_imaging) / all_headers[0])
-        session_start_time = datetime.strptime(acquisition_date, '%Y/%m/%d %H:%M:%S')
-        session_start_time_tzaware = pytz.timezone('EST').localize(session_start_time)
+        session_start_time_tzaware = pytz.timezone('EST').localize(session.session_start_time)
         if session_start_time_tzaware != nwbfile.session_start_time:
             print("Session start time in current nwbfile does not match the start time from rsd files.")
             print("Ophys data conversion aborted.")
@@ -186,16 +135,21 @@ class FRETDataInterface(BaseDataInterface):
         else:
             add_trials = True
 
-        # Iterate over trials, creates a FRET group per trial
-        trials_numbers = [f.split('-')[1].replace('.rsh', '') for f in all_headers]
-        for tr in trials_numbers:
-            # Read trial-specific metadata file .rsh
-            trial_meta_A = os.path.join(dir_cortical_imaging, f"{fname_prefix}-{tr}_A.rsh")
-            trial_meta_B = os.path.join(dir_cortical_imaging, f"{fname_prefix}-{tr}_B.rsh")
-            file_rsm_A, files_raw_A, acquisition_date_A, sample_rate_A, n_frames_A = self.read_trial_meta(trial_meta=trial_meta_A)
-            file_rsm_B, files_raw_B, acquisition_date_B, sample_rate_B, n_frames_B = self.read_trial_meta(trial_meta=trial_meta_B)
+        # Blocks are decoded ahead in the order they are written: donor, then acceptor of each trial
+        if num_workers is None or num_workers > 1:
+            prefetcher = RSDPrefetcher(num_workers=num_workers, max_pending_blocks=max_pending_blocks)
+        else:
+            prefetcher = None
 
-            absolute_start_time = datetime.strptime(acquisition_date_A, '%Y/%m/%d %H:%M:%S')
+        # Iterate over trials, creates a FRET group per trial
+        for tr in session.trials:
+            # Trial-specific metadata, from the .rsh files of both channels
+            meta_A = session.get_channel(tr, 'A')
+            meta_B = session.get_channel(tr, 'B')
+            acquisition_date_A, sample_rate_A, n_frames_A = meta_A['acquisition_date'], meta_A['sample_rate'], meta_A['n_frames']
+            acquisition_date_B, sample_rate_B, n_frames_B = meta_B['acquisition_date'], meta_B['sample_rate'], meta_B['n_frames']
+
+            absolute_start_time = session.get_start_time(tr, 'A')
             relative_start_time = float((absolute_start_time - nwbfile.session_start_time.replace(tzinfo=None)).seconds)
 
             # Checks if Acceptor and Donor channels have the same basic parameters
@@ -208,18 +162,16 @@ class FRETDataInterface(BaseDataInterface):
             assert relative_start_time >= 0., \
                 "Starting time is negative. Trial=" + str(tr)
 
-            # Create iterator
-            data_donor = DataChunkIterator(
-                data=data_gen(channel='A', trial=tr),
-                iter_axis=0,
-                buffer_size=10000,
-                maxshape=(None, 100, 100)
+            # Create iterators, yielding blocks of frames
+            data_donor = RSDDataChunkIterator(
+                filenames=session.get_raw_files(tr, 'A'),
+                progress_label='channel A, trial: ' + str(tr),
+                prefetcher=prefetcher
             )
-            data_acceptor = DataChunkIterator(
-                data=data_gen(channel='B', trial=tr),
-                iter_axis=0,
-                buffer_size=10000,
-                maxshape=(None, 100, 100)
+            data_acceptor = RSDDataChunkIterator(
+                filenames=session.get_raw_files(tr, 'B'),
+                progress_label='channel B, trial: ' + str(tr),
+                prefetcher=prefetcher
             )
 
             # FRETSeries
@@ -229,7 +181,7 @@ class FRETDataInterface(BaseDataInterface):
                 optical_channel=opt_ch_donor,
                 device=device,
                 description=meta_donor['description'],
-                data=data_donor,
+                data=wrap_data(data_donor, write_options),
                 starting_time=relative_start_time,
                 rate=sample_rate_A,
                 unit=meta_donor['unit'],
@@ -240,7 +192,7 @@ class FRETDataInterface(BaseDataInterface):
                 optical_channel=opt_ch_acceptor,
                 device=device,
                 description=meta_acceptor['description'],
-                data=data_acceptor,
+                data=wrap_data(data_acceptor, write_options),
                 starting_time=relative_start_time,
                 rate=sample_rate_B,
                 unit=meta_acceptor['unit']
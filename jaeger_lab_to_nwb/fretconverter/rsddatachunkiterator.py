@@ -0,0 +1,173 @@
+from jaeger_lab_to_nwb.resources.load_rsd.read_rsd import read_rsd_frames, split_frames
+from hdmf.data_utils import AbstractDataChunkIterator, DataChunk
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import numpy as np
+import os
+
+
+def decode_block(filename, start, stop):
+    """Reads frames start to stop of a .rsd file, as a C-contiguous (frames, 100, 100) image stack."""
+    images, _ = split_frames(read_rsd_frames(filename)[start:stop])
+    return np.ascontiguousarray(images)
+
+
+class RSDPrefetcher(object):
+    """Decodes the blocks of a sequence of RSDDataChunkIterators ahead of their writing, in a thread pool.
+
+    Iterators are registered in the order they are expected to be written (e.g. donor and
+    acceptor of each trial, trial after trial). While the blocks of one iterator are being
+    written, the next blocks are read and decoded by worker threads, following on to the
+    next registered iterators, so reading and decoding the next trial overlaps with writing
+    the current one. At most max_pending_blocks blocks (by default, twice the number of
+    workers) are decoded ahead, which bounds memory to that many blocks of buffer_size frames.
+    If blocks are asked in another order, the blocks decoded ahead are dropped and
+    prefetching resumes from the block asked.
+
+    Example:
+    prefetcher = RSDPrefetcher(num_workers=4)
+    data_donor = RSDDataChunkIterator(files_A, prefetcher=prefetcher)
+    data_acceptor = RSDDataChunkIterator(files_B, prefetcher=prefetcher)
+    """
+
+    def __init__(self, num_workers=None, max_pending_blocks=None):
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        self.num_workers = max(num_workers, 1)
+        if max_pending_blocks is None:
+            max_pending_blocks = 2 * self.num_workers
+        self.max_pending_blocks = max(max_pending_blocks, 1)
+        self.iterators = []
+        self.pending = collections.deque()
+        self.next_key = None
+        self.executor = None
+
+    def register(self, iterator):
+        """Appends iterator to the sequence of iterators to prefetch, and returns its index."""
+        self.iterators.append(iterator)
+        return len(self.iterators) - 1
+
+    def get_block(self, index, block):
+        """Returns the images of block of the iterator at index."""
+        if len(self.pending) == 0 or self.pending[0][0] != (index, block):
+            self._drop_pending()
+            self.next_key = (index, block)
+        self._fill()
+        _, future = self.pending.popleft()
+        self._fill()
+        images = future.result()
+        if len(self.pending) == 0 and self.next_key is None:
+            # Last block of the last iterator: no thread is left waiting for work
+            self.close()
+        return images
+
+    def _fill(self):
+        while len(self.pending) < self.max_pending_blocks and self.next_key is not None:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='rsd_decode')
+            index, block = self.next_key
+            self.pending.append((self.next_key, self.executor.submit(decode_block, *self.iterators[index].blocks[block])))
+            self.next_key = self._advance(index, block)
+
+    def _advance(self, index, block):
+        """Key of the block after block of the iterator at index, or None at the end of the sequence."""
+        block += 1
+        while block >= len(self.iterators[index].blocks):
+            index, block = index + 1, 0
+            if index == len(self.iterators):
+                return None
+        return index, block
+
+    def _drop_pending(self):
+        for _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+
+    def close(self):
+        """Drops the blocks decoded ahead and stops the worker threads."""
+        self._drop_pending()
+        self.next_key = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+class RSDDataChunkIterator(AbstractDataChunkIterator):
+    """Iterates over the images of a list of .rsd files in blocks of frames.
+
+    Files are memory-mapped (see read_rsd_frames), and each DataChunk is a block of
+    buffer_size (frames, 100, 100) images, decoded with a single negation of the block.
+    The number of frames of all files is known from their size before iterating, so the
+    full data shape is known up front, and a file that does not hold a whole number of
+    frames raises before anything is written. Only one block is decoded in memory at a
+    time, whatever the size of the files.
+
+    With a prefetcher (RSDPrefetcher), blocks are decoded ahead by its worker threads, while
+    the previous ones are being written.
+    """
+
+    def __init__(self, filenames, buffer_size=None, chunk_mb=1.0, buffer_mb=100.0, progress_label=None,
+                 prefetcher=None):
+        self.filenames = [str(fname) for fname in filenames]
+        self.progress_label = progress_label
+        file_frames = [read_rsd_frames(fname).shape[0] for fname in self.filenames]
+        self.num_frames = sum(file_frames)
+        self._item_shape = (100, 100)
+        self._dtype = np.dtype(np.int16)
+
+        frame_bytes = self._dtype.itemsize * int(np.prod(self._item_shape))
+        self._chunk_shape = (max(1, min(int(chunk_mb * 1e6 // frame_bytes), self.num_frames)),) + self._item_shape
+        if buffer_size is None:
+            # Whole HDF5 chunks per buffer
+            num_chunks = max(1, int(buffer_mb * 1e6 // (frame_bytes * self._chunk_shape[0])))
+            buffer_size = num_chunks * self._chunk_shape[0]
+        self.buffer_size = buffer_size
+
+        # (filename, start, stop) frames of each block
+        self.blocks = [
+            (fname, start, min(start + self.buffer_size, n_frames))
+            for fname, n_frames in zip(self.filenames, file_frames)
+            for start in range(0, n_frames, self.buffer_size)
+        ]
+        self.prefetcher = prefetcher
+        self._index = None if prefetcher is None else prefetcher.register(self)
+
+        self._blocks = self._iter_blocks()
+        self._position = 0
+
+    def _iter_blocks(self):
+        """Yields the images of the files in blocks of up to buffer_size frames."""
+        for block, (fname, start, stop) in enumerate(self.blocks):
+            if self.progress_label is not None and start == 0:
+                fn = self.filenames.index(fname)
+                print('adding ' + self.progress_label + ': ', 100 * fn / len(self.filenames), '%')
+            if self.prefetcher is None:
+                yield decode_block(fname, start, stop)
+            else:
+                yield self.prefetcher.get_block(self._index, block)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """Returns the next DataChunk of up to buffer_size frames."""
+        images = next(self._blocks)
+        start = self._position
+        self._position += images.shape[0]
+        return DataChunk(data=images, selection=np.s_[start:self._position, :, :])
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return self._chunk_shape
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def maxshape(self):
+        return (self.num_frames,) + self._item_shape
@@ -2,6 +2,8 @@ from nwb_conversion_tools.basedatainterface import BaseDataInterface
 from nwb_conversion_tools.utils import get_schema_from_hdmf_class
 from nwb_conversion_tools.json_schema_utils import get_base_schema
 
+from jaeger_lab_to_nwb.resources.write_options import get_write_options_schema, get_write_options, wrap_data
+
 from pynwb import NWBFile, TimeSeries
 from pynwb.device import Device
 from pynwb.ogen import OptogeneticStimulusSite, OptogeneticSeries
@@ -41,6 +43,13 @@ class LabviewDataInterface(BaseDataInterface):
             OptogeneticStimulusSite=get_schema_from_hdmf_class(OptogeneticStimulusSite),
             OptogeneticSeries=get_schema_from_hdmf_class(OptogeneticSeries)
         )
+
+        # Write options schema
+        metadata_schema['properties']['WriteOptions'] = get_base_schema()
+        metadata_schema['properties']['WriteOptions']['properties'] = {
+            'default': get_write_options_schema(),
+            self.__class__.__name__: get_write_options_schema()
+        }
         return metadata_schema
 
     def get_metadata(self):
@@ -68,7 +77,7 @@ class LabviewDataInterface(BaseDataInterface):
         )
         return metadata
 
-    def run_conversion(self, nwbfile: NWBFile, metadata: dict):
+    def run_conversion(self, nwbfile: NWBFile, metadata: dict, write_options: dict = None):
         """
         Run conversion for this data interface.
         Reads labview experiment behavioral data and adds it to nwbfile.
@@ -77,7 +86,14 @@ class LabviewDataInterface(BaseDataInterface):
         ----------
         nwbfile : NWBFile
         metadata : dict
+        write_options : dict, optional
+            HDF5 chunking and compression options of the behavioral and optogenetics time series,
+            with keys chunk_shape, compression ('gzip', 'lzf' or 'blosc'), compression_opts, shuffle
+            and blosc_codec.
+            Overrides the options found in metadata['WriteOptions'].
         """
+        write_options = get_write_options(metadata, self.__class__.__name__, write_options)
+
         print("Converting Labview data...")
         # Get list of trial summary files
         dir_behavior_labview = self.source_data['dir_behavior_labview']
@@ -197,13 +213,13 @@ class LabviewDataInterface(BaseDataInterface):
         print("Converting Labview behavior data...")
         l1_ts = TimeSeries(
             name="left_lick",
-            data=df_continuous['Lick 1'].to_numpy(),
+            data=wrap_data(df_continuous['Lick 1'].to_numpy(), write_options),
             timestamps=df_continuous['Time'].to_numpy() - t0,
             description="no description"
         )
         l2_ts = TimeSeries(
             name="right_lick",
-            data=df_continuous['Lick 2'].to_numpy(),
+            data=wrap_data(df_continuous['Lick 2'].to_numpy(), write_options),
             timestamps=df_continuous['Time'].to_numpy() - t0,
             description="no description"
         )
@@ -231,7 +247,7 @@ class LabviewDataInterface(BaseDataInterface):
         meta_ogen_series = metadata['Ogen']['OptogeneticSeries']
         ogen_series = OptogeneticSeries(
             name=meta_ogen_series['name'],
-            data=df_continuous['Opto'].to_numpy(),
+            data=wrap_data(df_continuous['Opto'].to_numpy(), write_options),
             site=ogen_stim_site,
             timestamps=df_continuous['Time'].to_numpy() - t0,
             description=meta_ogen_series['description'],
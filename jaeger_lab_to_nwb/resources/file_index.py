@@ -0,0 +1,66 @@
+# Written for Jaeger Lab
+# Per-file index entries of a directory, cached in a JSON sidecar file
+# ------------------------------------------------------------------------------
+from pathlib import Path
+import json
+import os
+
+
+def get_file_stat(filename):
+    """Return the resolved path, size and modification time of filename, the keys of an index entry."""
+    filename = Path(filename).resolve()
+    stat = filename.stat()
+    return dict(path=str(filename), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def load_file_index(index_file, version):
+    """Return the cached entries of the sidecar index_file, keyed by path.
+
+    A missing or unreadable sidecar, or one written with another version, holds no entry.
+    """
+    try:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    if index.get('version') != version:
+        return dict()
+    return {entry['path']: entry for entry in index['files']}
+
+
+def save_file_index(index_file, version, entries):
+    """Write entries to the sidecar index_file. A read-only data directory is not an error."""
+    index_file = Path(index_file)
+    try:
+        tmp_file = index_file.with_name(index_file.name + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(dict(version=version, files=entries), f)
+        os.replace(tmp_file, index_file)
+    except OSError:
+        pass
+
+
+def index_files(filenames, index_function, index_file, version, persist=True):
+    """Return the index entries of filenames, parsing only the files that changed since they were cached.
+
+    index_function(filename) returns the entry of one file: a JSON serializable dictionary
+    holding (at least) the keys of get_file_stat. Entries are cached in the sidecar
+    index_file, keyed by path and validated against the file size and modification time, so
+    the files that did not change are not opened again. Bump version when the entries change
+    format, to discard the cached ones.
+    """
+    cached = load_file_index(index_file, version)
+    entries = []
+    changed = False
+    for filename in filenames:
+        stat = get_file_stat(filename)
+        entry = cached.get(stat['path'])
+        if entry is None or entry['size'] != stat['size'] or entry['mtime_ns'] != stat['mtime_ns']:
+            entry = index_function(filename)
+            changed = True
+        entries.append(entry)
+    changed = changed or len(cached) != len(entries)
+
+    if changed and persist and len(entries) > 0:
+        save_file_index(index_file, version, entries)
+    return entries
@@ -0,0 +1,186 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Streaming per-channel quality control of amplifier data
+# ------------------------------------------------------------------------------
+
+import json
+import numpy as np
+
+# Per-channel QC metrics: (dtype, description)
+QC_METRICS = dict(
+    qc_mean=(np.float64, 'Mean of the channel, in volts.'),
+    qc_std=(np.float64, 'Standard deviation of the channel, in volts.'),
+    qc_rms=(np.float64, 'Root mean square of the channel, in volts.'),
+    qc_saturated_samples=(np.int64, 'Number of samples at the limits of the amplifier range.'),
+    qc_max_flat_duration=(np.float64, 'Longest run of identical consecutive samples, in seconds.'),
+    qc_flat=(bool, 'True if the channel holds a flat line longer than the flat line threshold.'),
+    qc_line_50hz=(np.float64, 'RMS amplitude of the 50 Hz line noise, in volts.'),
+    qc_line_60hz=(np.float64, 'RMS amplitude of the 60 Hz line noise, in volts.'),
+)
+
+
+class ChannelQC(object):
+    """Streaming per-channel quality control of (samples, channels) chunks.
+
+    Chunks are accumulated one after another, so the metrics of a whole session are
+    computed in the pass that writes it, with memory bounded by the chunk size:
+    - mean, standard deviation and RMS, from running moments combined chunk by chunk
+      (Chan et al. pairwise update), which stay accurate over billions of samples;
+    - number of saturated samples, at the limits of the integer sample range;
+    - longest flat line (run of identical samples), carried across chunks;
+    - line noise at 50 and 60 Hz, as the RMS amplitude of the DFT bin of each frequency,
+      averaged over windows of window_duration seconds carried across chunks.
+
+    Samples are scaled to volts with conversion (and offset, for the mean).
+
+    Example:
+    qc = ChannelQC(30000., conversion=0.195e-6)
+    for chunk in chunks:
+        qc(chunk)
+    summary = qc.get_summary()
+    """
+
+    def __init__(self, sample_rate, conversion=1., offset=0., saturation_range=None, flat_duration=0.1,
+                 line_frequencies=(50., 60.), window_duration=1., samples_per_pass=65536):
+        self.sample_rate = float(sample_rate)
+        self.conversion = conversion
+        self.offset = offset
+        self.saturation_range = saturation_range
+        self.flat_duration = flat_duration
+        self.line_frequencies = list(line_frequencies)
+        self.window_size = int(round(window_duration * self.sample_rate))
+        self.samples_per_pass = samples_per_pass
+
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.saturated = None
+        self.last_sample = None
+        self.flat_run = None
+        self.max_flat_run = None
+        self.window = None
+        self.num_windows = 0
+        self.line_power = None
+        # DFT kernels of one window at each line frequency
+        k = np.arange(self.window_size)
+        self.kernels = np.exp(-2j * np.pi * np.outer(self.line_frequencies, k) / self.sample_rate)
+        self._summary = None
+
+    def __call__(self, input):
+        """Accumulates the next chunk of the stream."""
+        if self.mean is None:
+            num_channels = input.shape[1]
+            self.mean = np.zeros(num_channels)
+            self.m2 = np.zeros(num_channels)
+            self.saturated = np.zeros(num_channels, dtype=np.int64)
+            self.flat_run = np.zeros(num_channels, dtype=np.int64)
+            self.max_flat_run = np.zeros(num_channels, dtype=np.int64)
+            self.line_power = np.zeros((len(self.line_frequencies), num_channels))
+            self.window = np.zeros((0, num_channels))
+            if self.saturation_range is None and np.issubdtype(input.dtype, np.integer):
+                info = np.iinfo(input.dtype)
+                self.saturation_range = (info.min, info.max)
+        for start in range(0, input.shape[0], self.samples_per_pass):
+            self._update(input[start:start + self.samples_per_pass])
+
+    def _update(self, block):
+        num_samples = block.shape[0]
+        if num_samples == 0:
+            return
+        x = block.astype(np.float64)
+
+        # Running moments
+        block_mean = x.mean(axis=0)
+        block_m2 = np.square(x - block_mean).sum(axis=0)
+        count = self.count + num_samples
+        delta = block_mean - self.mean
+        self.mean += delta * (num_samples / count)
+        self.m2 += block_m2 + np.square(delta) * (self.count * num_samples / count)
+        self.count = count
+
+        # Saturation
+        if self.saturation_range is not None:
+            low, high = self.saturation_range
+            self.saturated += np.count_nonzero((block <= low) | (block >= high), axis=0)
+
+        # Flat lines: number of samples equal to their predecessor since the last change
+        previous = block[:1] if self.last_sample is None else self.last_sample
+        equal = np.equal(block, np.concatenate([previous, block[:-1]]))
+        if self.last_sample is None:
+            equal[0] = False
+        index = np.arange(num_samples)[:, None]
+        last_change = np.maximum.accumulate(np.where(equal, -1, index), axis=0)
+        run = index - last_change
+        run = np.where(last_change < 0, run + self.flat_run, run)
+        self.flat_run = run[-1]
+        np.maximum(self.max_flat_run, run.max(axis=0), out=self.max_flat_run)
+        self.last_sample = block[-1:].copy()
+
+        # Line noise, over whole windows
+        self.window = np.concatenate([self.window, x])
+        num_windows = self.window.shape[0] // self.window_size
+        if num_windows > 0:
+            windows = self.window[:num_windows * self.window_size].reshape(num_windows, self.window_size, -1)
+            windows = windows - windows.mean(axis=1, keepdims=True)
+            for ii, kernel in enumerate(self.kernels):
+                coefficients = np.einsum('wkc,k->wc', windows, kernel)
+                self.line_power[ii] += np.square(np.abs(coefficients)).sum(axis=0)
+            self.num_windows += num_windows
+            self.window = self.window[num_windows * self.window_size:]
+
+    def get_summary(self):
+        """Returns the per-channel metrics (see QC_METRICS), as arrays."""
+        if self._summary is not None:
+            return self._summary
+        if self.count == 0:
+            raise ValueError('No sample was given to the channel QC.')
+        mean = self.mean * self.conversion + self.offset
+        std = np.sqrt(self.m2 / self.count) * abs(self.conversion)
+        summary = dict(
+            qc_mean=mean,
+            qc_std=std,
+            qc_rms=np.sqrt(np.square(std) + np.square(mean)),
+            qc_saturated_samples=self.saturated,
+            qc_max_flat_duration=(self.max_flat_run + 1) / self.sample_rate,
+            qc_flat=(self.max_flat_run + 1) / self.sample_rate >= self.flat_duration,
+        )
+        for frequency, power in zip(self.line_frequencies, self.line_power):
+            # A sine of amplitude A gives a DFT coefficient of A * N / 2, for a RMS amplitude of A / sqrt(2)
+            if self.num_windows > 0:
+                line_rms = np.sqrt(2 * power / self.num_windows) / self.window_size * abs(self.conversion)
+            else:
+                line_rms = np.full(self.mean.shape, np.nan)
+            summary['qc_line_{:g}hz'.format(frequency)] = line_rms
+        self._summary = summary
+        return summary
+
+    def save_summary(self, filename, channel_names=None):
+        """Writes the per-channel metrics and QC parameters to a JSON file."""
+        summary = self.get_summary()
+        num_channels = len(summary['qc_mean'])
+        if channel_names is None:
+            channel_names = [str(ii) for ii in range(num_channels)]
+        channels = [
+            dict(channel=name, **{key: _to_json(values[ii]) for key, values in summary.items()})
+            for ii, name in enumerate(channel_names)
+        ]
+        with open(filename, 'w') as f:
+            json.dump(dict(
+                num_samples=self.count,
+                sample_rate=self.sample_rate,
+                flat_duration=self.flat_duration,
+                saturation_range=None if self.saturation_range is None else [int(v) for v in self.saturation_range],
+                line_frequencies=self.line_frequencies,
+                num_line_noise_windows=self.num_windows,
+                flat_channels=[name for name, flat in zip(channel_names, summary['qc_flat']) if flat],
+                channels=channels
+            ), f, indent=2)
+
+
+def _to_json(value):
+    """Python scalar of a NumPy scalar, with NaN as None (null in JSON)."""
+    value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
@@ -0,0 +1,69 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Flat binary copy of streamed (samples, channels) chunks, e.g. for spike sorters
+# ------------------------------------------------------------------------------
+
+import json
+from pathlib import Path
+
+
+class DatWriter(object):
+    """Appends streamed (samples, channels) chunks to a flat binary file.
+
+    Samples are written as they come, in the dtype of the chunks and with interleaved
+    channels (all channels of sample 0, then of sample 1...), the layout read by Kilosort,
+    SpyKING CIRCUS or phy. On close, a JSON sidecar (the .dat file with a .json suffix,
+    by default) describes the file: dtype, number of channels and samples, sample rate,
+    conversion to volts and the given probe description.
+
+    Example:
+    dat = DatWriter('session.dat', sample_rate=30000., conversion=0.195e-6)
+    for chunk in chunks:
+        dat(chunk)
+    dat.close()
+    """
+
+    def __init__(self, filename, sample_rate, conversion=1., offset=0., probe=None, file_params=None):
+        self.filename = Path(filename)
+        self.file_params = self.filename.with_suffix('.json') if file_params is None else Path(file_params)
+        self.sample_rate = sample_rate
+        self.conversion = conversion
+        self.offset = offset
+        self.probe = probe
+        self.num_samples = 0
+        self.num_channels = None
+        self.dtype = None
+        self.fid = open(self.filename, 'wb')
+
+    def __call__(self, input):
+        """Appends the next chunk of the stream."""
+        if self.dtype is None:
+            self.dtype = input.dtype
+            self.num_channels = input.shape[1]
+        elif input.dtype != self.dtype or input.shape[1] != self.num_channels:
+            raise ValueError('Chunks of {} channels of {} expected, got {} channels of {}.'.format(
+                self.num_channels, self.dtype, input.shape[1], input.dtype))
+        self.fid.write(memoryview(input.astype(self.dtype.newbyteorder('<'), order='C', copy=False)).cast('B'))
+        self.num_samples += input.shape[0]
+
+    def close(self):
+        """Closes the binary file and writes its JSON sidecar."""
+        if self.fid.closed:
+            return
+        self.fid.close()
+        params = dict(
+            dat_path=self.filename.name,
+            dtype=None if self.dtype is None else self.dtype.newbyteorder('<').str,
+            n_channels_dat=self.num_channels,
+            num_samples=self.num_samples,
+            offset=0,
+            sample_rate=self.sample_rate,
+            conversion=self.conversion,
+            conversion_offset=self.offset,
+            hp_filtered=False
+        )
+        if self.probe is not None:
+            params['probe'] = self.probe
+        with open(self.file_params, 'w') as f:
+            json.dump(params, f, indent=2)
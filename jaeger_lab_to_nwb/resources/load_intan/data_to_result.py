@@ -34,33 +34,55 @@ def data_to_result(header, data, data_present):
 
     if header['num_amplifier_channels'] > 0:
         result['amplifier_channels'] = header['amplifier_channels']
-        if data_present:
+        if data_present and 'amplifier_data' in data:
             result['amplifier_data'] = data['amplifier_data']
             result['amplifier_data_conversion_factor'] = data['amplifier_data_conversion_factor']
+            if 'amplifier_data_offset' in data:
+                result['amplifier_data_offset'] = data['amplifier_data_offset']
 
     if header['num_aux_input_channels'] > 0:
         result['aux_input_channels'] = header['aux_input_channels']
-        if data_present:
+        if data_present and 'aux_input_data' in data:
             result['aux_input_data'] = data['aux_input_data']
+            if 'aux_input_data_offset' in data:
+                result['aux_input_data_conversion_factor'] = data['aux_input_data_conversion_factor']
+                result['aux_input_data_offset'] = data['aux_input_data_offset']
 
     if header['num_supply_voltage_channels'] > 0:
         result['supply_voltage_channels'] = header['supply_voltage_channels']
-        if data_present:
+        if data_present and 'supply_voltage_data' in data:
             result['supply_voltage_data'] = data['supply_voltage_data']
+            if 'supply_voltage_data_offset' in data:
+                result['supply_voltage_data_conversion_factor'] = data['supply_voltage_data_conversion_factor']
+                result['supply_voltage_data_offset'] = data['supply_voltage_data_offset']
+
+    if header['num_temp_sensor_channels'] > 0:
+        if data_present and 'temp_sensor_data' in data:
+            result['temp_sensor_data'] = data['temp_sensor_data']
+            if 'temp_sensor_data_offset' in data:
+                result['temp_sensor_data_conversion_factor'] = data['temp_sensor_data_conversion_factor']
+                result['temp_sensor_data_offset'] = data['temp_sensor_data_offset']
 
     if header['num_board_adc_channels'] > 0:
         result['board_adc_channels'] = header['board_adc_channels']
-        if data_present:
+        if data_present and 'board_adc_data' in data:
             result['board_adc_data'] = data['board_adc_data']
+            if 'board_adc_data_offset' in data:
+                result['board_adc_data_conversion_factor'] = data['board_adc_data_conversion_factor']
+                result['board_adc_data_offset'] = data['board_adc_data_offset']
 
     if header['num_board_dig_in_channels'] > 0:
         result['board_dig_in_channels'] = header['board_dig_in_channels']
-        if data_present:
+        if data_present and 'board_dig_in_data' in data:
             result['board_dig_in_data'] = data['board_dig_in_data']
+        elif data_present and 'board_dig_in_raw' in data:
+            result['board_dig_in_raw'] = data['board_dig_in_raw']
 
     if header['num_board_dig_out_channels'] > 0:
         result['board_dig_out_channels'] = header['board_dig_out_channels']
-        if data_present:
+        if data_present and 'board_dig_out_data' in data:
             result['board_dig_out_data'] = data['board_dig_out_data']
+        elif data_present and 'board_dig_out_raw' in data:
+            result['board_dig_out_raw'] = data['board_dig_out_raw']
 
     return result
@@ -0,0 +1,117 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Rising and falling edges of the board digital lines of Intan RHD2000 files
+# ------------------------------------------------------------------------------
+
+import os
+import numpy as np
+
+from .read_header import read_header
+from .iter_rhd_chunks import iter_rhd_chunks
+
+
+class DigitalEdgeDetector(object):
+    """Finds the edges of digital lines from packed 16-bit words streamed chunk by chunk.
+
+    Each line is one bit (its native_order) of the words. Transitions are found with a
+    single pass over the words, comparing each word to the previous one, and the lines are
+    only looked at on the few samples where a transition happened, so the dense (channels,
+    samples) boolean matrix is never built. The last word of a chunk is kept to find the
+    edges at the boundary with the next chunk. The state of the lines at the first sample
+    of the stream is taken as their initial state, not as an edge.
+
+    Example:
+    detector = DigitalEdgeDetector(header['board_dig_in_channels'])
+    for chunk in chunks:
+        detector.update(chunk['board_dig_in_raw'], chunk['t_amplifier'])
+    edges = detector.get_edges()
+    """
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.native_orders = np.array([channel['native_order'] for channel in channels], dtype=int)
+        self.masks = np.left_shift(1, self.native_orders).astype(np.uint16)
+        self.all_lines_mask = np.bitwise_or.reduce(self.masks) if len(self.masks) > 0 else np.uint16(0)
+        self.initial_word = None
+        self.last_word = None
+        self.num_samples = 0
+        self.samples = []
+        self.times = []
+        self.words = []
+        self.changes = []
+
+    def update(self, words, timestamps=None):
+        """Adds the next chunk of packed words, and their timestamps in seconds."""
+        words = np.asarray(words, dtype=np.uint16).reshape(-1)
+        if words.shape[0] == 0:
+            return
+        if self.last_word is None:
+            self.initial_word = words[0]
+            previous = np.concatenate([words[:1], words[:-1]])
+        else:
+            previous = np.concatenate([[self.last_word], words[:-1]])
+
+        changes = np.bitwise_and(np.bitwise_xor(words, previous), self.all_lines_mask)
+        index = np.flatnonzero(changes)
+        self.samples.append(index + self.num_samples)
+        self.words.append(words[index])
+        self.changes.append(changes[index])
+        if timestamps is not None:
+            self.times.append(np.asarray(timestamps).reshape(-1)[index])
+
+        self.last_word = words[-1]
+        self.num_samples += words.shape[0]
+
+    def get_edges(self):
+        """Returns the edges found so far, as a dictionary keyed by native channel name.
+
+        Each line gets a dictionary with its initial state and the sample indices (counted
+        from the start of the stream) of its rising and falling edges, along with their times
+        in seconds when timestamps were given.
+        """
+        samples = np.concatenate(self.samples) if self.samples else np.zeros(0, dtype=np.int64)
+        words = np.concatenate(self.words) if self.words else np.zeros(0, dtype=np.uint16)
+        changes = np.concatenate(self.changes) if self.changes else np.zeros(0, dtype=np.uint16)
+        times = np.concatenate(self.times) if self.times else None
+
+        edges = dict()
+        for channel, mask in zip(self.channels, self.masks):
+            toggled = np.not_equal(np.bitwise_and(changes, mask), 0)
+            high = np.not_equal(np.bitwise_and(words, mask), 0)
+            rising = toggled & high
+            falling = toggled & ~high
+            line = dict(
+                initial_state=self.initial_word is not None and bool(self.initial_word & mask),
+                rising_samples=samples[rising],
+                falling_samples=samples[falling]
+            )
+            if times is not None:
+                line['rising_times'] = times[rising]
+                line['falling_times'] = times[falling]
+            edges[channel['native_channel_name']] = line
+        return edges
+
+
+def get_digital_edges(filename, stream='board_dig_in', blocks_per_chunk=10000):
+    """Reads the rising and falling edges of the digital inputs (or outputs) of RHD2000 file(s).
+
+    filename is one file or a list of files read as one continuous session, see
+    iter_rhd_chunks. stream is 'board_dig_in' or 'board_dig_out'. Only the timestamps and
+    packed digital words are read, chunk by chunk.
+
+    Returns a dictionary keyed by native channel name, see DigitalEdgeDetector.get_edges.
+    """
+
+    if stream not in ('board_dig_in', 'board_dig_out'):
+        raise ValueError('Unknown digital stream: {}'.format(stream))
+
+    filenames = [filename] if isinstance(filename, (str, os.PathLike)) else list(filename)
+    with open(filenames[0], 'rb') as fid:
+        header = read_header(fid)
+
+    detector = DigitalEdgeDetector(header[stream + '_channels'])
+    for chunk in iter_rhd_chunks(filenames, blocks_per_chunk=blocks_per_chunk, compact=True, streams=[stream]):
+        if stream + '_raw' in chunk:
+            detector.update(chunk[stream + '_raw'], chunk['t_amplifier'])
+    return detector.get_edges()
@@ -0,0 +1,87 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Bounded-memory streaming of one or more Intan RHD2000 files
+# ------------------------------------------------------------------------------
+
+import os
+import numpy as np
+
+from .read_header import read_header
+from .get_bytes_per_data_block import get_bytes_per_data_block
+from .read_data_blocks import get_data_block_dtype, read_data_blocks, decode_data_blocks
+from .notch_filter import NotchFilter
+
+
+def iter_rhd_chunks(filename, blocks_per_chunk=1000, compact=False, streams=None, amplifier_channels=None,
+                    apply_notch_filter=False):
+    """Reads Intan Technologies RHD2000 data file(s) chunk by chunk.
+
+    Yields data dictionaries holding blocks_per_chunk data blocks each (the last one may be
+    shorter), with the same keys and scaling as the data read by read_data: timestamps,
+    amplifier data, digital lines and the other selected streams. With compact=True, chunks
+    are kept raw (native uint16 samples and packed digital words). Only one chunk is decoded
+    in memory at a time.
+
+    filename can also be a list of files, sorted in acquisition order, which are then read
+    as one continuous session: chunks carry on across file boundaries. All files must share
+    the same sample rate and data block layout.
+
+    streams and amplifier_channels select the data to decode, see read_data.
+
+    If apply_notch_filter is True and a software notch filter was selected during the
+    recording, amplifier data are notch filtered, with the filter state carried across
+    chunks and files.
+    """
+
+    if isinstance(filename, (str, os.PathLike)):
+        filenames = [filename]
+    else:
+        filenames = list(filename)
+
+    first_header = None
+    notch = None
+    pending = []
+    num_pending_blocks = 0
+    for fname in filenames:
+        with open(fname, 'rb') as fid:
+            header = read_header(fid)
+            if first_header is None:
+                first_header = header
+                if apply_notch_filter and header['notch_filter_frequency'] > 0:
+                    notch = NotchFilter(header['sample_rate'], header['notch_filter_frequency'], 10)
+            elif header['sample_rate'] != first_header['sample_rate'] or \
+                    get_data_block_dtype(header) != get_data_block_dtype(first_header):
+                raise Exception('Data layout of {} does not match the first file of the session.'.format(fname))
+
+            bytes_per_block = get_bytes_per_data_block(header)
+            bytes_remaining = os.path.getsize(fname) - fid.tell()
+            if bytes_remaining % bytes_per_block != 0:
+                raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+            num_data_blocks = int(bytes_remaining // bytes_per_block)
+            if num_data_blocks == 0:
+                continue
+            blocks = read_data_blocks(fid, header, num_data_blocks, streams=streams)
+
+        start = 0
+        while start < num_data_blocks:
+            stop = min(start + blocks_per_chunk - num_pending_blocks, num_data_blocks)
+            pending.append(blocks[start:stop])
+            num_pending_blocks += stop - start
+            start = stop
+            if num_pending_blocks == blocks_per_chunk:
+                yield _decode_pending(pending, first_header, compact, amplifier_channels, notch)
+                pending = []
+                num_pending_blocks = 0
+
+    if num_pending_blocks > 0:
+        yield _decode_pending(pending, first_header, compact, amplifier_channels, notch)
+
+
+def _decode_pending(pending, header, compact, amplifier_channels, notch):
+    """Decodes the data blocks collected for one chunk, possibly coming from several files."""
+    blocks = pending[0] if len(pending) == 1 else np.concatenate(pending)
+    data = decode_data_blocks(blocks, header, compact=compact, amplifier_channels=amplifier_channels)
+    if notch is not None and 'amplifier_data' in data:
+        notch.apply(data['amplifier_data'])
+    return data
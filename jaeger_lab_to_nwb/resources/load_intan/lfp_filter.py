@@ -0,0 +1,103 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Stateful low-pass filtering and decimation of streamed (samples, channels) chunks
+# ------------------------------------------------------------------------------
+
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+
+class Decimator(object):
+    """Keeps one sample out of q of a stream of (samples, ...) chunks.
+
+    The decimation phase is carried from one call to the next, so decimating a stream
+    chunk by chunk keeps samples 0, q, 2q... of the whole stream, whatever the chunk sizes.
+    reset starts a new stream: the next sample is kept, e.g. the first one after a gap.
+
+    Example:
+    decimator = Decimator(30)
+    for chunk in chunks:
+        out = decimator(chunk)
+    """
+
+    def __init__(self, q):
+        self.q = int(q)
+        self.phase = 0  # index, in the next chunk, of the next sample kept
+
+    def get_num_samples(self, num_samples):
+        """Number of samples kept from a stream of num_samples samples."""
+        return -(-num_samples // self.q)
+
+    def reset(self):
+        """Starts a new stream at the next chunk."""
+        self.phase = 0
+
+    def __call__(self, input):
+        """Returns the samples kept from the next chunk of the stream."""
+        out = input[self.phase::self.q]
+        self.phase = (self.phase - input.shape[0]) % self.q
+        return out
+
+
+class LFPFilter(Decimator):
+    """Stateful low-pass filter and decimator for streamed (samples, channels) chunks.
+
+    Each chunk is filtered by a Butterworth low-pass filter (second-order sections) and one
+    sample out of q is kept. The filter state and decimation phase are carried from one call
+    to the next, so filtering a stream chunk by chunk, across files, gives the same output as
+    filtering it at once. The filter starts in its steady state for the first sample of the
+    stream, to avoid a step transient. It is causal, so the output lags the input by the
+    group delay of the filter (about 1 ms at 300 Hz for order 4). reset starts a new stream
+    at the next chunk, e.g. after a gap in acquisition time: the filter starts again in its
+    steady state for the next sample, which is kept.
+
+    Integer input (e.g. int16 amplifier samples) is rounded back to its own dtype, in the
+    same units as the input.
+
+    Example:
+    lfp = LFPFilter(30000., q=30, cutoff=300.)
+    for chunk in chunks:
+        out = lfp(chunk)
+    """
+
+    def __init__(self, fSample, q, cutoff=300., order=4, samples_per_pass=65536):
+        if not 0 < cutoff < fSample / (2. * q):
+            raise ValueError('The low-pass cutoff ({} Hz) must be below the Nyquist frequency of the '
+                             'decimated data ({} Hz).'.format(cutoff, fSample / (2. * q)))
+        super().__init__(q)
+        self.sos = butter(order, cutoff, btype='lowpass', output='sos', fs=fSample)
+        self.samples_per_pass = samples_per_pass
+        self.zi = None
+
+    def reset(self):
+        """Starts a new stream at the next chunk."""
+        super().reset()
+        self.zi = None
+
+    def __call__(self, input):
+        """Returns the filtered samples kept from the next chunk of the stream."""
+        num_samples = input.shape[0]
+        first = self.phase
+        out = np.empty((self.get_num_samples(max(num_samples - first, 0)),) + input.shape[1:], dtype=input.dtype)
+        integer = np.issubdtype(input.dtype, np.integer)
+        if integer:
+            info = np.iinfo(input.dtype)
+
+        if self.zi is None and num_samples > 0:
+            # Steady state of the filter for a constant input equal to the first sample
+            zi = sosfilt_zi(self.sos).reshape((self.sos.shape[0], 2) + (1,) * (input.ndim - 1))
+            self.zi = zi * np.asarray(input[0], dtype=np.float64)
+
+        # Filter samples_per_pass samples at a time, to bound memory use
+        filled = 0
+        for start in range(0, num_samples, self.samples_per_pass):
+            filtered, self.zi = sosfilt(self.sos, input[start:start + self.samples_per_pass], axis=0, zi=self.zi)
+            kept = filtered[(first - start) % self.q::self.q]
+            if integer:
+                np.clip(np.rint(kept, out=kept), info.min, info.max, out=kept)
+            out[filled:filled + kept.shape[0]] = kept
+            filled += kept.shape[0]
+
+        self.phase = (self.phase - num_samples) % self.q
+        return out
@@ -12,15 +12,31 @@ import numpy as np
 
 from .read_header import read_header
 from .get_bytes_per_data_block import get_bytes_per_data_block
-from .read_one_data_block import read_one_data_block
-# from .notch_filter import notch_filter
+from .read_data_blocks import read_data_blocks, decode_data_blocks
+from .notch_filter import NotchFilter
 from .data_to_result import data_to_result
 
 
-def read_data(filename, print_details=False):
+def read_data(filename, print_details=False, compact=False, streams=None, amplifier_channels=None,
+              apply_notch_filter=False):
     """Reads Intan Technologies RHD2000 data file generated by evaluation board GUI.
 
     Data are returned in a dictionary, for future extensibility.
+
+    If compact is True, analog streams are kept as their native uint16 samples and
+    digital inputs and outputs as packed 16-bit words ('board_dig_in_raw' and
+    'board_dig_out_raw'). Each analog stream then comes with '<stream>_data_conversion_factor'
+    and '<stream>_data_offset' fields, such that value = raw * conversion_factor + offset.
+
+    streams restricts decoding to a list of data streams, among 'amplifier', 'aux_input',
+    'supply_voltage', 'temp_sensor', 'board_adc', 'board_dig_in' and 'board_dig_out'; the
+    bytes of the other streams are skipped. amplifier_channels restricts the amplifier data
+    to a list of indices into the header amplifier channels, which are then the only ones
+    listed in 'amplifier_channels' and 'spike_triggers'. By default, everything is read.
+
+    If apply_notch_filter is True and a software notch filter was selected during the
+    recording (header['notch_filter_frequency'] > 0), the same notch filter is applied to the
+    amplifier data, which keep their dtype.
     """
 
     tic = time.time()
@@ -54,11 +70,6 @@ def read_data(filename, print_details=False):
     num_data_blocks = int(bytes_remaining / bytes_per_block)
 
     num_amplifier_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_aux_input_samples = int((header['num_samples_per_data_block'] / 4) * num_data_blocks)
-    num_supply_voltage_samples = 1 * num_data_blocks
-    num_board_adc_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_board_dig_in_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_board_dig_out_samples = header['num_samples_per_data_block'] * num_data_blocks
 
     record_time = num_amplifier_samples / header['sample_rate']
 
@@ -69,65 +80,23 @@ def read_data(filename, print_details=False):
             print('Header file contains no data.  Amplifiers were sampled at {:0.2f} kS/s.'.format(header['sample_rate'] / 1000))
 
     if data_present:
-        # Pre-allocate memory for data.
+        # Read sampled data from file.
         if print_details:
             print('')
-            print('Allocating memory for data...')
-
-        data = {}
-        if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=np.int)
-        else:
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=np.uint)
-
-        data['amplifier_data'] = np.zeros([header['num_amplifier_channels'], num_amplifier_samples], dtype=np.uint)
-        data['aux_input_data'] = np.zeros([header['num_aux_input_channels'], num_aux_input_samples], dtype=np.uint)
-        data['supply_voltage_data'] = np.zeros([header['num_supply_voltage_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['temp_sensor_data'] = np.zeros([header['num_temp_sensor_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['board_adc_data'] = np.zeros([header['num_board_adc_channels'], num_board_adc_samples], dtype=np.uint)
-
-        # by default, this script interprets digital events (digital inputs and outputs) as booleans
-        # if unsigned int values are preferred(0 for False, 1 for True), replace the 'dtype=np.bool' argument with 'dtype=np.uint' as shown
-        # the commented line below illustrates this for digital input data; the same can be done for digital out
-
-        # data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.uint)
-        data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.bool)
-        data['board_dig_in_raw'] = np.zeros(num_board_dig_in_samples, dtype=np.uint)
+            print('Reading data from file...')
 
-        data['board_dig_out_data'] = np.zeros([header['num_board_dig_out_channels'], num_board_dig_out_samples], dtype=np.bool)
-        data['board_dig_out_raw'] = np.zeros(num_board_dig_out_samples, dtype=np.uint)
+        blocks = read_data_blocks(fid, header, num_data_blocks, streams=streams)
 
-        # Read sampled data from file.
+        # Check for gaps in timestamps.
+        num_gaps = np.sum(np.not_equal(np.diff(blocks['timestamps'].reshape(-1)), 1))
         if print_details:
-            print('Reading data from file...')
-
-        # Initialize indices used in looping
-        indices = {}
-        indices['amplifier'] = 0
-        indices['aux_input'] = 0
-        indices['supply_voltage'] = 0
-        indices['board_adc'] = 0
-        indices['board_dig_in'] = 0
-        indices['board_dig_out'] = 0
-
-        print_increment = 10
-        percent_done = print_increment
-        for i in range(num_data_blocks):
-            read_one_data_block(data, header, indices, fid)
-
-            # Increment indices
-            indices['amplifier'] += header['num_samples_per_data_block']
-            indices['aux_input'] += int(header['num_samples_per_data_block'] / 4)
-            indices['supply_voltage'] += 1
-            indices['board_adc'] += header['num_samples_per_data_block']
-            indices['board_dig_in'] += header['num_samples_per_data_block']
-            indices['board_dig_out'] += header['num_samples_per_data_block']
-
-            fraction_done = 100 * (1.0 * i / num_data_blocks)
-            if fraction_done >= percent_done:
-                percent_done = percent_done + print_increment
-                if print_details:
-                    print('{}% done...'.format(percent_done))
+            if num_gaps == 0:
+                print('No missing timestamps in data.')
+            else:
+                print('Warning: {0} gaps in timestamp data found.  Time scale will not be uniform!'.format(num_gaps))
+            print('Parsing data...')
+        data = decode_data_blocks(blocks, header, compact=compact, amplifier_channels=amplifier_channels)
+        del blocks
 
         # Make sure we have read exactly the right amount of data.
         bytes_remaining = filesize - fid.tell()
@@ -137,70 +106,22 @@ def read_data(filename, print_details=False):
     # Close data file.
     fid.close()
 
-    if (data_present):
-        if print_details:
-            print('Parsing data...')
-
-        # Extract digital input channels to separate variables.
-        for i in range(header['num_board_dig_in_channels']):
-            data['board_dig_in_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_in_raw'], (1 << header['board_dig_in_channels'][i]['native_order'])), 0)
-
-        # Extract digital output channels to separate variables.
-        for i in range(header['num_board_dig_out_channels']):
-            data['board_dig_out_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_out_raw'], (1 << header['board_dig_out_channels'][i]['native_order'])), 0)
-
-        # Scale voltage levels appropriately.
-        # This line is the original (IntanTech provided) conversion to uVolts
-        # data['amplifier_data'] = np.multiply(0.195, (data['amplifier_data'].astype(np.int32) - 32768))      # units = microvolts
-        # This line modifies it, to get the data in int32 and the conversion scale to Volts
-        data['amplifier_data'] = data['amplifier_data'].astype(np.int32) - 32768  # int32 dtype
-        data['amplifier_data_conversion_factor'] = 0.195e-6  # conversion factor to Volts
-
-        data['aux_input_data'] = np.multiply(37.4e-6, data['aux_input_data'])               # units = volts
-        data['supply_voltage_data'] = np.multiply(74.8e-6, data['supply_voltage_data'])     # units = volts
-        if header['eval_board_mode'] == 1:
-            data['board_adc_data'] = np.multiply(152.59e-6, (data['board_adc_data'].astype(np.int32) - 32768))  # units = volts
-        elif header['eval_board_mode'] == 13:
-            data['board_adc_data'] = np.multiply(312.5e-6, (data['board_adc_data'].astype(np.int32) - 32768))  # units = volts
-        else:
-            data['board_adc_data'] = np.multiply(50.354e-6, data['board_adc_data'])           # units = volts
-        data['temp_sensor_data'] = np.multiply(0.01, data['temp_sensor_data'])               # units = deg C
+    if not data_present:
+        data = []
 
-        # Check for gaps in timestamps.
-        num_gaps = np.sum(np.not_equal(data['t_amplifier'][1:] - data['t_amplifier'][:-1], 1))
+    # If the software notch filter was selected during the recording, apply the
+    # same notch filter to amplifier data here.
+    if apply_notch_filter and data_present and 'amplifier_data' in data and header['notch_filter_frequency'] > 0:
         if print_details:
-            if num_gaps == 0:
-                print('No missing timestamps in data.')
-            else:
-                print('Warning: {0} gaps in timestamp data found.  Time scale will not be uniform!'.format(num_gaps))
-
-        # Scale time steps (units = seconds).
-        data['t_amplifier'] = data['t_amplifier'] / header['sample_rate']
-        data['t_aux_input'] = data['t_amplifier'][range(0, len(data['t_amplifier']), 4)]
-        data['t_supply_voltage'] = data['t_amplifier'][range(0, len(data['t_amplifier']), header['num_samples_per_data_block'])]
-        data['t_board_adc'] = data['t_amplifier']
-        data['t_dig'] = data['t_amplifier']
-        data['t_temp_sensor'] = data['t_supply_voltage']
-
-        # # If the software notch filter was selected during the recording, apply the
-        # # same notch filter to amplifier data here.
-        # if header['notch_filter_frequency'] > 0:
-        #     print('Applying notch filter...')
-        #
-        #     print_increment = 10
-        #     percent_done = print_increment
-        #     for i in range(header['num_amplifier_channels']):
-        #         data['amplifier_data'][i, :] = notch_filter(data['amplifier_data'][i, :], header['sample_rate'], header['notch_filter_frequency'], 10)
-        #
-        #         fraction_done = 100 * (i / header['num_amplifier_channels'])
-        #         if fraction_done >= percent_done:
-        #             print('{}% done...'.format(percent_done))
-        #             percent_done += print_increment
-    else:
-        data = []
+            print('Applying notch filter...')
+        notch = NotchFilter(header['sample_rate'], header['notch_filter_frequency'], 10)
+        notch.apply(data['amplifier_data'])
 
     # Move variables to result struct.
     result = data_to_result(header, data, data_present)
+    if amplifier_channels is not None and header['num_amplifier_channels'] > 0:
+        result['amplifier_channels'] = [header['amplifier_channels'][i] for i in np.arange(header['num_amplifier_channels'])[amplifier_channels]]
+        result['spike_triggers'] = [header['spike_triggers'][i] for i in np.arange(header['num_amplifier_channels'])[amplifier_channels]]
 
     if print_details:
         print('Done!  Elapsed time: {0:0.1f} seconds'.format(time.time() - tic))
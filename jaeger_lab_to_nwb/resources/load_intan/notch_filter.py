@@ -1,9 +1,12 @@
 #! /bin/env python
 #
 # Michael Gibson 27 April 2015
+# Modified for Jaeger Lab: vectorized over channels, with filter state carried across chunks
 
 import math
 import numpy as np
+from scipy.signal import lfilter
+
 
 def notch_filter(input, fSample, fNotch, Bandwidth):
     """Implements a notch filter (e.g., for 50 or 60 Hz) on vector 'input'.
@@ -15,36 +18,84 @@ def notch_filter(input, fSample, fNotch, Bandwidth):
     poor time-domain properties with an extended ringing response to
     transient disturbances.
 
+    'input' can also be a (channels, samples) array, in which case all channels
+    are filtered at once.
+
     Example:  If neural data was sampled at 30 kSamples/sec
     and you wish to implement a 60 Hz notch filter:
 
     out = notch_filter(input, 30000, 60, 10);
     """
 
-    tstep = 1.0/fSample
-    Fc = fNotch*tstep
-
-    L = len(input)
-
-    # Calculate IIR filter parameters
-    d = math.exp(-2.0*math.pi*(Bandwidth/2.0)*tstep)
-    b = (1.0 + d*d) * math.cos(2.0*math.pi*Fc)
-    a0 = 1.0
-    a1 = -b
-    a2 = d*d
-    a = (1.0 + d*d)/2.0
-    b0 = 1.0
-    b1 = -2.0 * math.cos(2.0*math.pi*Fc)
-    b2 = 1.0
-
-    out = np.zeros(len(input))
-    out[0] = input[0]
-    out[1] = input[1]
-    # (If filtering a continuous data stream, change out[0:1] to the
-    #  previous final two values of out.)
-
-    # Run filter
-    for i in range(2,L):
-        out[i] = (a*b2*input[i-2] + a*b1*input[i-1] + a*b0*input[i] - a2*out[i-2] - a1*out[i-1])/a0
-
-    return out
+    return NotchFilter(fSample, fNotch, Bandwidth)(input)
+
+
+class NotchFilter(object):
+    """Stateful notch filter for data streamed as successive (channels, samples) chunks.
+
+    The filter state is carried from one call to the next, so filtering a stream chunk
+    by chunk gives the same output as filtering it at once, without edge transients at
+    chunk (or file) boundaries. As in notch_filter, the first two output samples of the
+    stream are the input samples.
+
+    Example:
+    notch = NotchFilter(30000, 60, 10)
+    for chunk in chunks:
+        out = notch(chunk)
+    """
+
+    def __init__(self, fSample, fNotch, Bandwidth=10):
+        tstep = 1.0/fSample
+        Fc = fNotch*tstep
+
+        # Calculate IIR filter parameters
+        d = math.exp(-2.0*math.pi*(Bandwidth/2.0)*tstep)
+        b = (1.0 + d*d) * math.cos(2.0*math.pi*Fc)
+        a1 = -b
+        a2 = d*d
+        a = (1.0 + d*d)/2.0
+        b0 = 1.0
+        b1 = -2.0 * math.cos(2.0*math.pi*Fc)
+        b2 = 1.0
+
+        self.b = np.array([a*b0, a*b1, a*b2])
+        self.a = np.array([1.0, a1, a2])
+        self.zi = None
+
+    def __call__(self, input):
+        """Filters the next chunk of the stream along its last (time) axis."""
+        x = np.asarray(input, dtype=np.float64)
+        if self.zi is not None:
+            out, self.zi = lfilter(self.b, self.a, x, axis=-1, zi=self.zi)
+            return out
+
+        # Start of the stream: pass the first two samples through and derive the
+        # filter state they leave (direct form II transposed, as used by lfilter)
+        if x.shape[-1] < 2:
+            raise ValueError('The first chunk of a stream must hold at least two samples.')
+        out = np.empty_like(x)
+        out[..., :2] = x[..., :2]
+        x0, x1 = x[..., 0], x[..., 1]
+        self.zi = np.stack([
+            self.b[1]*x1 + self.b[2]*x0 - self.a[1]*x1 - self.a[2]*x0,
+            self.b[2]*x1 - self.a[2]*x1
+        ], axis=-1)
+        out[..., 2:], self.zi = lfilter(self.b, self.a, x[..., 2:], axis=-1, zi=self.zi)
+        return out
+
+    def apply(self, data, samples_per_pass=65536):
+        """Filters the next chunk of the stream in place.
+
+        The chunk is filtered samples_per_pass samples at a time, to bound memory use.
+        Integer data are rounded back to their own dtype (e.g. int32 amplifier counts or
+        native uint16 samples, the filter leaving the 32768 offset unchanged).
+        """
+        integer = np.issubdtype(data.dtype, np.integer)
+        if integer:
+            info = np.iinfo(data.dtype)
+        for start in range(0, data.shape[-1], samples_per_pass):
+            out = self(data[..., start:start + samples_per_pass])
+            if integer:
+                np.clip(np.rint(out, out=out), info.min, info.max, out=out)
+            data[..., start:start + samples_per_pass] = out
+        return data
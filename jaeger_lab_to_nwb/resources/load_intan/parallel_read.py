@@ -0,0 +1,98 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Parallel decoding of the files of an Intan RHD2000 session, in worker processes
+# ------------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from .load_intan import read_data
+
+
+def iter_read_data(filenames, num_workers=1, max_pending_files=None, tmp_dir=None, keys=None, **kwargs):
+    """Reads a list of rhd files with read_data, yielding (filename, result) pairs in file order.
+
+    With num_workers > 1, upcoming files are decoded in worker processes while the caller
+    consumes the current one. Workers write the arrays of their result to .npy files in a
+    temporary directory, which are handed back as read-only memory maps, so decoded data
+    never go through a pipe. At most max_pending_files files (by default, twice the number
+    of workers) are decoded ahead of the caller, which caps the disk and memory in use. The
+    temporary files of a result are removed once the caller asks for the next one, so
+    arrays of a result should be copied if they need to outlive the iteration step.
+
+    With num_workers <= 1, files are read one after another in the calling process.
+
+    keys restricts the arrays of each result to the ones the caller consumes, e.g.
+    ['amplifier_data', 't_amplifier']: the other arrays (e.g. the timestamps of every stream)
+    are dropped, and never written by the workers. By default, all arrays are kept.
+
+    kwargs are passed to read_data, e.g. streams=['amplifier', 'board_dig_in'], which restricts
+    decoding to the streams of the consumed arrays.
+    """
+
+    filenames = [str(filename) for filename in filenames]
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(filenames))
+    if num_workers <= 1:
+        for filename in filenames:
+            yield filename, _select_arrays(read_data(filename, **kwargs), keys)
+        return
+
+    if max_pending_files is None:
+        max_pending_files = 2 * num_workers
+    max_pending_files = max(max_pending_files, 1)
+
+    work_dir = tempfile.mkdtemp(prefix='rhd_decode_', dir=tmp_dir)
+    executor = ProcessPoolExecutor(max_workers=num_workers)
+    pending = collections.deque()
+    try:
+        next_file = 0
+        while next_file < len(filenames) or pending:
+            while next_file < len(filenames) and len(pending) < max_pending_files:
+                file_dir = os.path.join(work_dir, '{:06d}'.format(next_file))
+                pending.append(executor.submit(_read_data_to_npy, filenames[next_file], file_dir, keys, kwargs))
+                next_file += 1
+
+            filename, file_dir, arrays, others = pending.popleft().result()
+            result = dict(others)
+            for key in arrays:
+                result[key] = np.load(os.path.join(file_dir, key + '.npy'), mmap_mode='r')
+            yield filename, result
+
+            del result
+            shutil.rmtree(file_dir, ignore_errors=True)
+    finally:
+        # Also reached when the caller stops early: drop the files not started yet
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _select_arrays(result, keys):
+    """Drops the arrays of result that are not under keys (all arrays are kept if keys is None)."""
+    if keys is None:
+        return result
+    return {key: value for key, value in result.items()
+            if key in keys or not (isinstance(value, np.ndarray) and value.dtype != object)}
+
+
+def _read_data_to_npy(filename, file_dir, keys, kwargs):
+    """Worker: reads one file and saves the arrays of its result under keys in file_dir."""
+    result = _select_arrays(read_data(filename, **kwargs), keys)
+    os.makedirs(file_dir)
+    arrays = []
+    others = dict()
+    for key, value in result.items():
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            np.save(os.path.join(file_dir, key + '.npy'), value)
+            arrays.append(key)
+        else:
+            others[key] = value
+    return filename, file_dir, arrays, others
@@ -0,0 +1,249 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Replaces the block-by-block reader (read_one_data_block) with a single bulk read
+# ------------------------------------------------------------------------------
+
+import os
+import numpy as np
+
+from .get_bytes_per_data_block import get_bytes_per_data_block
+
+# Names of the data streams stored in each data block, besides the timestamps
+DATA_STREAMS = ['amplifier', 'aux_input', 'supply_voltage', 'temp_sensor', 'board_adc', 'board_dig_in', 'board_dig_out']
+
+
+def get_data_block_dtype(header, streams=None):
+    """Builds a NumPy structured dtype describing one 60 or 128 sample data block.
+
+    Fields follow the on-disk order of the RHD2000 file format. Streams without
+    enabled channels are left out of the dtype. If a list of streams is given, only
+    those streams and the timestamps get a field; the bytes of the other streams are
+    left as padding, so the dtype still spans a whole data block.
+    """
+
+    num_samples = header['num_samples_per_data_block']
+
+    # In version 1.2, we moved from saving timestamps as unsigned
+    # integers to signed integers to accommodate negative (adjusted)
+    # timestamps for pretrigger data
+    if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
+        fields = [('timestamps', '<i4', (num_samples,))]
+    else:
+        fields = [('timestamps', '<u4', (num_samples,))]
+
+    if header['num_amplifier_channels'] > 0:
+        fields.append(('amplifier', '<u2', (header['num_amplifier_channels'], num_samples)))
+    if header['num_aux_input_channels'] > 0:
+        fields.append(('aux_input', '<u2', (header['num_aux_input_channels'], num_samples // 4)))
+    if header['num_supply_voltage_channels'] > 0:
+        fields.append(('supply_voltage', '<u2', (header['num_supply_voltage_channels'], 1)))
+    if header['num_temp_sensor_channels'] > 0:
+        fields.append(('temp_sensor', '<u2', (header['num_temp_sensor_channels'], 1)))
+    if header['num_board_adc_channels'] > 0:
+        fields.append(('board_adc', '<u2', (header['num_board_adc_channels'], num_samples)))
+    if header['num_board_dig_in_channels'] > 0:
+        fields.append(('board_dig_in', '<u2', (num_samples,)))
+    if header['num_board_dig_out_channels'] > 0:
+        fields.append(('board_dig_out', '<u2', (num_samples,)))
+
+    block_dtype = np.dtype(fields)
+    if block_dtype.itemsize != get_bytes_per_data_block(header):
+        raise Exception('Data block layout does not match the number of bytes per data block.')
+
+    if streams is not None:
+        unknown_streams = set(streams) - set(DATA_STREAMS)
+        if unknown_streams:
+            raise ValueError('Unknown data streams: {}'.format(sorted(unknown_streams)))
+        names = [name for name in block_dtype.names if name == 'timestamps' or name in streams]
+        block_dtype = np.dtype(dict(
+            names=names,
+            formats=[block_dtype.fields[name][0] for name in names],
+            offsets=[block_dtype.fields[name][1] for name in names],
+            itemsize=block_dtype.itemsize
+        ))
+
+    return block_dtype
+
+
+def read_data_blocks(fid, header, num_data_blocks, streams=None):
+    """Maps num_data_blocks data blocks, starting at the current position of fid, into one array.
+
+    The returned array is a read-only memory map of the file, so no sample is copied until
+    it is unpacked, and streams left out of the streams list are never touched. fid is left
+    positioned right after the last block.
+    """
+
+    block_dtype = get_data_block_dtype(header, streams=streams)
+    offset = fid.tell()
+    if os.fstat(fid.fileno()).st_size < offset + num_data_blocks * block_dtype.itemsize:
+        raise Exception('Error: Unexpected end of file.')
+
+    blocks = np.memmap(fid, dtype=block_dtype, mode='r', offset=offset, shape=(num_data_blocks,))
+    fid.seek(offset + num_data_blocks * block_dtype.itemsize)
+
+    return blocks
+
+
+def unpack_data_blocks(blocks, header, signed_amplifier=False, amplifier_channels=None):
+    """Moves the fields of an array of data blocks into contiguous per-stream arrays.
+
+    Channel data are returned as raw uint16 arrays of shape (channels, samples), for the
+    streams that have a field in the blocks dtype only. If signed_amplifier is True, amplifier
+    samples are returned as int32 with the 32768 offset removed, in the same pass that
+    reorders them. If amplifier_channels (a list of indices into header['amplifier_channels'])
+    is given, only those amplifier channels are unpacked.
+    """
+
+    num_data_blocks = blocks.shape[0]
+    names = blocks.dtype.names
+
+    def _stream(field, dtype=np.uint16, offset=0):
+        num_channels, samples_per_block = field.shape[1:]
+        stream = np.empty([num_channels, num_data_blocks * samples_per_block], dtype=dtype)
+        # Write the (blocks, channels, samples) field straight into (channels, blocks, samples) order
+        np.subtract(field.transpose(1, 0, 2), offset, dtype=dtype,
+                    out=stream.reshape(num_channels, num_data_blocks, samples_per_block))
+        return stream
+
+    data = {}
+    data['t_amplifier'] = blocks['timestamps'].reshape(-1)
+    if 'amplifier' in names:
+        field = blocks['amplifier']
+        if amplifier_channels is not None:
+            field = field[:, amplifier_channels, :]
+        if signed_amplifier:
+            data['amplifier_data'] = _stream(field, np.int32, 32768)
+        else:
+            data['amplifier_data'] = _stream(field)
+    for name in ['aux_input', 'supply_voltage', 'temp_sensor', 'board_adc']:
+        if name in names:
+            data[name + '_data'] = _stream(blocks[name])
+    for name in ['board_dig_in', 'board_dig_out']:
+        if name in names:
+            data[name + '_raw'] = blocks[name].reshape(-1)
+
+    return data
+
+
+def scale_data_stream(name, raw, header):
+    """Scales raw uint16 samples of one stream the same way read_data does.
+
+    Amplifier samples are returned as int32 with the 32768 offset removed (multiply by
+    0.195e-6 to get Volts), the other analog streams in Volts and temperature in deg C.
+    """
+
+    if name == 'amplifier':
+        return np.subtract(raw, 32768, dtype=np.int32)                  # int32 dtype
+    if name == 'aux_input':
+        return np.multiply(37.4e-6, raw)                                # units = volts
+    if name == 'supply_voltage':
+        return np.multiply(74.8e-6, raw)                                # units = volts
+    if name == 'temp_sensor':
+        return np.multiply(0.01, raw)                                   # units = deg C
+    if name == 'board_adc':
+        if header['eval_board_mode'] == 1:
+            return np.multiply(152.59e-6, (raw.astype(np.int32) - 32768))  # units = volts
+        elif header['eval_board_mode'] == 13:
+            return np.multiply(312.5e-6, (raw.astype(np.int32) - 32768))   # units = volts
+        return np.multiply(50.354e-6, raw)                              # units = volts
+    raise ValueError('Unknown data stream: {}'.format(name))
+
+
+def get_stream_conversion(name, header):
+    """Returns the (conversion_factor, offset) pair turning raw uint16 samples of one stream into
+    physical units (Volts, or deg C for the temperature sensor), as value = raw * conversion_factor + offset.
+    """
+
+    if name == 'amplifier':
+        return 0.195e-6, -32768 * 0.195e-6
+    if name == 'aux_input':
+        return 37.4e-6, 0.
+    if name == 'supply_voltage':
+        return 74.8e-6, 0.
+    if name == 'temp_sensor':
+        return 0.01, 0.
+    if name == 'board_adc':
+        if header['eval_board_mode'] == 1:
+            return 152.59e-6, -32768 * 152.59e-6
+        elif header['eval_board_mode'] == 13:
+            return 312.5e-6, -32768 * 312.5e-6
+        return 50.354e-6, 0.
+    raise ValueError('Unknown data stream: {}'.format(name))
+
+
+def get_stream_decimation(name, header):
+    """Returns the number of amplifier samples per sample of one stream."""
+
+    if name in ['amplifier', 'board_adc', 'board_dig_in', 'board_dig_out']:
+        return 1
+    if name == 'aux_input':
+        return 4
+    if name in ['supply_voltage', 'temp_sensor']:
+        return header['num_samples_per_data_block']
+    raise ValueError('Unknown data stream: {}'.format(name))
+
+
+def to_signed_samples(raw, out=None):
+    """Turns raw uint16 samples into int16 samples, raw - 32768, in place or into out.
+
+    Flipping the top bit of each sample removes the 32768 offset without widening the
+    samples. Returns an int16 view of raw (or out, an int16 array shaped as raw). The offset
+    given by get_stream_conversion becomes offset + 32768 * conversion_factor for the signed
+    samples (0 for amplifier samples).
+    """
+
+    if out is None:
+        out = raw.view(np.int16)
+    np.bitwise_xor(raw, np.uint16(0x8000), out=out.view(np.uint16))
+    return out
+
+
+def decode_data_blocks(blocks, header, compact=False, amplifier_channels=None):
+    """Unpacks and scales an array of data blocks into the data dictionary built by read_data.
+
+    See read_data for the meaning of compact and amplifier_channels.
+    """
+
+    data = unpack_data_blocks(blocks, header, signed_amplifier=not compact, amplifier_channels=amplifier_channels)
+    num_samples = data['t_amplifier'].shape[0]
+
+    if compact:
+        # Keep samples in their native 16-bit form, value = raw * conversion_factor + offset
+        for name in ['amplifier', 'aux_input', 'supply_voltage', 'temp_sensor', 'board_adc']:
+            if name + '_data' in data:
+                conversion_factor, offset = get_stream_conversion(name, header)
+                data[name + '_data_conversion_factor'] = conversion_factor
+                data[name + '_data_offset'] = offset
+    else:
+        # Extract digital input and output channels to separate variables.
+        # by default, this script interprets digital events (digital inputs and outputs) as booleans
+        for name in ['board_dig_in', 'board_dig_out']:
+            if name + '_raw' in data:
+                channels = header[name + '_channels']
+                data[name + '_data'] = np.zeros([len(channels), num_samples], dtype=bool)
+                for i in range(len(channels)):
+                    data[name + '_data'][i, :] = np.not_equal(np.bitwise_and(data[name + '_raw'], (1 << channels[i]['native_order'])), 0)
+
+        # Scale voltage levels appropriately.
+        # The original (IntanTech provided) conversion to uVolts is
+        # data['amplifier_data'] = np.multiply(0.195, (data['amplifier_data'].astype(np.int32) - 32768))      # units = microvolts
+        # Here the data are kept in int32 (the 32768 offset is removed when unpacking the data blocks)
+        # together with the conversion scale to Volts
+        if 'amplifier_data' in data:
+            data['amplifier_data_conversion_factor'] = 0.195e-6  # conversion factor to Volts
+
+        # Other analog streams are scaled to volts (temperature sensors to deg C)
+        for name in ['aux_input', 'supply_voltage', 'board_adc', 'temp_sensor']:
+            if name + '_data' in data:
+                data[name + '_data'] = scale_data_stream(name, data[name + '_data'], header)
+
+    # Scale time steps (units = seconds).
+    data['t_amplifier'] = data['t_amplifier'] / header['sample_rate']
+    data['t_aux_input'] = data['t_amplifier'][::4]
+    data['t_supply_voltage'] = data['t_amplifier'][::header['num_samples_per_data_block']]
+    data['t_board_adc'] = data['t_amplifier']
+    data['t_dig'] = data['t_amplifier']
+    data['t_temp_sensor'] = data['t_supply_voltage']
+
+    return data
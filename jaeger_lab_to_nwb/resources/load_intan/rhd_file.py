@@ -0,0 +1,209 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Lazy, memory-mapped access to Intan RHD2000 files
+# ------------------------------------------------------------------------------
+
+import os
+import numpy as np
+
+from .read_header import read_header
+from .read_data_blocks import get_data_block_dtype, scale_data_stream, get_stream_conversion
+
+
+class RHDFile(object):
+    """Memory-mapped Intan Technologies RHD2000 data file.
+
+    The header is parsed once and the data region is mapped, not read. Streams are exposed
+    as lazy array-like views indexed as [channels, samples], e.g.:
+
+    rhd = RHDFile('recording.rhd')
+    window = rhd.amplifier[:, 0:300000]   # first 10 s of all channels at 30 kS/s
+    t = rhd.t_amplifier[0:300000]
+
+    Only the data blocks overlapping the requested samples are touched. Samples are scaled
+    the same way read_data scales them; the native uint16 samples are available from the
+    read_raw method of each view.
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        with open(self.filename, 'rb') as fid:
+            self.header = read_header(fid)
+            self.data_offset = fid.tell()
+
+        self.block_dtype = get_data_block_dtype(self.header)
+        bytes_remaining = os.path.getsize(self.filename) - self.data_offset
+        if bytes_remaining % self.block_dtype.itemsize != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        self.num_data_blocks = bytes_remaining // self.block_dtype.itemsize
+        self.num_samples_per_data_block = self.header['num_samples_per_data_block']
+        self.num_samples = self.num_data_blocks * self.num_samples_per_data_block
+        self.sample_rate = self.header['sample_rate']
+
+        if self.num_data_blocks > 0:
+            self.blocks = np.memmap(self.filename, dtype=self.block_dtype, mode='r',
+                                    offset=self.data_offset, shape=(self.num_data_blocks,))
+        else:
+            self.blocks = np.zeros(0, dtype=self.block_dtype)
+
+        header = self.header
+        num_samples = self.num_samples_per_data_block
+        self.amplifier = _StreamView(self, 'amplifier', header['num_amplifier_channels'], num_samples)
+        self.aux_input = _StreamView(self, 'aux_input', header['num_aux_input_channels'], num_samples // 4)
+        self.supply_voltage = _StreamView(self, 'supply_voltage', header['num_supply_voltage_channels'], 1)
+        self.temp_sensor = _StreamView(self, 'temp_sensor', header['num_temp_sensor_channels'], 1)
+        self.board_adc = _StreamView(self, 'board_adc', header['num_board_adc_channels'], num_samples)
+        self.board_dig_in = _DigitalView(self, 'board_dig_in', header['board_dig_in_channels'])
+        self.board_dig_out = _DigitalView(self, 'board_dig_out', header['board_dig_out_channels'])
+
+        self.t_amplifier = _TimeView(self, 1)
+        self.t_aux_input = _TimeView(self, 4)
+        self.t_supply_voltage = _TimeView(self, num_samples)
+        self.t_board_adc = self.t_amplifier
+        self.t_dig = self.t_amplifier
+        self.t_temp_sensor = self.t_supply_voltage
+
+        self.amplifier_data_conversion_factor = 0.195e-6  # conversion factor to Volts
+
+    def close(self):
+        """Releases the memory map. Arrays already returned stay valid."""
+        self.blocks = np.zeros(0, dtype=self.block_dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '{}({!r}, {} channels, {} samples)'.format(
+            self.__class__.__name__, self.filename, self.header['num_amplifier_channels'], self.num_samples)
+
+    def locate_samples(self, samples_per_block, key):
+        """Returns the (block slice, local index) pair covering a time index given in stream samples."""
+        num_samples = self.num_data_blocks * samples_per_block
+        if isinstance(key, slice):
+            start, stop, step = key.indices(num_samples)
+            if step == 1:
+                if stop <= start:
+                    return slice(0, 0), slice(0, 0)
+                first_block = start // samples_per_block
+                last_block = (stop - 1) // samples_per_block + 1
+                offset = first_block * samples_per_block
+                return slice(first_block, last_block), slice(start - offset, stop - offset)
+            index = np.arange(start, stop, step)
+        else:
+            index = np.asarray(key)
+            if index.dtype == bool:
+                index = np.flatnonzero(index)
+            index = np.where(index < 0, index + num_samples, index)
+            if np.any(index < 0) or np.any(index >= num_samples):
+                raise IndexError('Sample index out of range for {} samples.'.format(num_samples))
+        if index.size == 0:
+            return slice(0, 0), np.zeros(index.shape, dtype=int)
+        first_block = int(index.min()) // samples_per_block
+        last_block = int(index.max()) // samples_per_block + 1
+        return slice(first_block, last_block), index - first_block * samples_per_block
+
+
+def _split_key(key):
+    """Splits an index into its (channels, samples) parts."""
+    if isinstance(key, tuple):
+        if len(key) > 2:
+            raise IndexError('Too many indices: views are indexed as [channels, samples].')
+        if len(key) == 1:
+            return key[0], slice(None)
+        return key
+    return key, slice(None)
+
+
+class _StreamView(object):
+    """Lazy (channels, samples) view of one analog stream of an RHDFile."""
+
+    def __init__(self, rhd, name, num_channels, samples_per_block):
+        self.rhd = rhd
+        self.name = name
+        self.num_channels = num_channels
+        self.samples_per_block = samples_per_block
+        # Raw samples from read_raw map to physical units as value = raw * conversion_factor + offset
+        self.conversion_factor, self.offset = get_stream_conversion(name, rhd.header)
+
+    @property
+    def shape(self):
+        return self.num_channels, self.rhd.num_data_blocks * self.samples_per_block
+
+    def __len__(self):
+        return self.num_channels
+
+    def read_raw(self, key):
+        """Returns the raw uint16 samples selected by key."""
+        channel_key, time_key = _split_key(key)
+        channels = np.arange(self.num_channels)[channel_key]
+        block_slice, local_key = self.rhd.locate_samples(self.samples_per_block, time_key)
+        if self.name not in self.rhd.blocks.dtype.names:
+            blocks = np.zeros((0, self.num_channels, self.samples_per_block), dtype=np.uint16)
+        else:
+            blocks = self.rhd.blocks[block_slice][self.name]
+        # (blocks, channels, samples) -> (channels, blocks * samples), touching only the selected blocks
+        if np.ndim(channels) == 0:
+            return blocks[:, channels, :].reshape(-1)[local_key]
+        raw = blocks[:, channels, :].transpose(1, 0, 2).reshape(len(channels), blocks.shape[0] * self.samples_per_block)
+        return raw[:, local_key]
+
+    def __getitem__(self, key):
+        return scale_data_stream(self.name, self.read_raw(key), self.rhd.header)
+
+
+class _DigitalView(object):
+    """Lazy (channels, samples) boolean view of the board digital inputs or outputs of an RHDFile."""
+
+    def __init__(self, rhd, name, channels):
+        self.rhd = rhd
+        self.name = name
+        self.native_orders = np.array([channel['native_order'] for channel in channels], dtype=int)
+
+    @property
+    def shape(self):
+        return len(self.native_orders), self.rhd.num_samples
+
+    def __len__(self):
+        return len(self.native_orders)
+
+    def read_raw(self, key):
+        """Returns the packed 16-bit digital words selected by a sample index."""
+        block_slice, local_key = self.rhd.locate_samples(self.rhd.num_samples_per_data_block, key)
+        if self.name not in self.rhd.blocks.dtype.names:
+            return np.zeros(0, dtype=np.uint16)
+        return self.rhd.blocks[block_slice][self.name].reshape(-1)[local_key]
+
+    def __getitem__(self, key):
+        channel_key, time_key = _split_key(key)
+        words = self.read_raw(time_key)
+        masks = np.left_shift(1, self.native_orders[channel_key]).astype(np.uint16)
+        return np.not_equal(np.bitwise_and.outer(masks, words), 0)
+
+
+class _TimeView(object):
+    """Lazy view of the timestamps (in seconds) of a stream sampled every decimation amplifier samples."""
+
+    def __init__(self, rhd, decimation):
+        self.rhd = rhd
+        self.decimation = decimation
+
+    @property
+    def shape(self):
+        return self.rhd.num_samples // self.decimation,
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read_raw(self, key):
+        """Returns the raw integer timestamps selected by key."""
+        samples_per_block = self.rhd.num_samples_per_data_block // self.decimation
+        block_slice, local_key = self.rhd.locate_samples(samples_per_block, key)
+        timestamps = self.rhd.blocks[block_slice]['timestamps'][:, ::self.decimation]
+        return timestamps.reshape(-1)[local_key]
+
+    def __getitem__(self, key):
+        return self.read_raw(key) / self.rhd.sample_rate
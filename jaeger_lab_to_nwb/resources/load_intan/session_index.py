@@ -0,0 +1,112 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Header-only index of a directory of Intan RHD2000 files, persisted as a sidecar file
+# ------------------------------------------------------------------------------
+
+import struct
+from pathlib import Path
+
+from ..file_index import get_file_stat, index_files
+from .read_header import read_header
+from .get_bytes_per_data_block import get_bytes_per_data_block
+
+# Name of the sidecar file written next to the rhd files
+INDEX_FILENAME = 'rhd_session_index.json'
+INDEX_VERSION = 1
+
+
+def index_rhd_file(filename):
+    """Reads the header of one rhd file and locates its data blocks, without reading any data.
+
+    Returns a dictionary with the file path, size and modification time, the parsed header,
+    the data offset and block size in bytes, the number of data blocks and samples, and the
+    first and last raw (integer) timestamps.
+    """
+
+    stat = get_file_stat(filename)
+    with open(stat['path'], 'rb') as fid:
+        header = read_header(fid)
+        data_offset = fid.tell()
+
+        bytes_per_block = int(get_bytes_per_data_block(header))
+        bytes_remaining = stat['size'] - data_offset
+        if bytes_remaining % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        num_data_blocks = bytes_remaining // bytes_per_block
+
+        # Timestamps are the first field of each block
+        first_timestamp = None
+        last_timestamp = None
+        if num_data_blocks > 0:
+            if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
+                timestamp_format = '<i'
+            else:
+                timestamp_format = '<I'
+            first_timestamp, = struct.unpack(timestamp_format, fid.read(4))
+            fid.seek(data_offset + (num_data_blocks - 1) * bytes_per_block + 4 * (header['num_samples_per_data_block'] - 1))
+            last_timestamp, = struct.unpack(timestamp_format, fid.read(4))
+
+    return dict(
+        header=header,
+        data_offset=data_offset,
+        bytes_per_block=bytes_per_block,
+        num_data_blocks=num_data_blocks,
+        num_samples=num_data_blocks * header['num_samples_per_data_block'],
+        first_timestamp=first_timestamp,
+        last_timestamp=last_timestamp,
+        **stat
+    )
+
+
+class RHDSessionIndex(object):
+    """Index of all rhd files in a directory, built from their headers only.
+
+    The index is kept in a sidecar file (rhd_session_index.json in the same directory, by
+    default, see index_files) with one entry per file. Files that did not change since the
+    index was written are not opened again, so building the index of a known session costs
+    a single small read.
+
+    Example:
+    index = RHDSessionIndex(dir_ecephys_rhd)
+    index.sample_rate, index.amplifier_channels, index.num_samples
+    for entry in index.files:
+        entry['path'], entry['num_data_blocks'], entry['first_timestamp']
+    """
+
+    def __init__(self, dir_rhd, index_file=None, persist=True):
+        self.dir_rhd = Path(dir_rhd)
+        if index_file is None:
+            index_file = self.dir_rhd / INDEX_FILENAME
+        self.index_file = Path(index_file)
+
+        self.files = index_files(sorted(self.dir_rhd.glob('*.rhd')), index_rhd_file, self.index_file,
+                                 INDEX_VERSION, persist=persist)
+        if len(self.files) == 0:
+            raise OSError(f"No .rhd file found in directory: {self.dir_rhd}.\n"
+                          "Did you choose the correct path for source data?")
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def filenames(self):
+        return [entry['path'] for entry in self.files]
+
+    @property
+    def header(self):
+        """Header of the first file of the session."""
+        return self.files[0]['header']
+
+    @property
+    def sample_rate(self):
+        return self.header['sample_rate']
+
+    @property
+    def amplifier_channels(self):
+        return self.header['amplifier_channels']
+
+    @property
+    def num_samples(self):
+        """Total number of amplifier samples in the session."""
+        return sum(entry['num_samples'] for entry in self.files)
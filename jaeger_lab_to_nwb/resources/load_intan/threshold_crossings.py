@@ -0,0 +1,265 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Streaming threshold crossing (spike) detection on amplifier data
+# ------------------------------------------------------------------------------
+
+import tempfile
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi
+
+
+def get_header_thresholds(header, conversion):
+    """Per-channel thresholds of the Intan Spike Scope settings, in units of samples scaled by conversion to volts.
+
+    The spike_triggers voltage thresholds of the header are in microvolts. Channels that do
+    not trigger on a voltage threshold (voltage_trigger_mode 0, digital trigger) or with a
+    threshold of 0 have no header threshold: theirs is NaN, which ThresholdDetector replaces
+    with a noise based (MAD) threshold.
+    """
+    thresholds = np.array([
+        trigger['voltage_threshold'] if trigger['voltage_trigger_mode'] == 1 and trigger['voltage_threshold'] != 0
+        else np.nan
+        for trigger in header['spike_triggers']
+    ], dtype=np.float64)
+    return thresholds * 1e-6 / conversion
+
+
+class ThresholdDetector(object):
+    """Streaming threshold crossing detector for (samples, channels) chunks.
+
+    Chunks are high-pass filtered (Butterworth, with the filter state carried across chunks),
+    and a crossing is the first sample of each channel at or beyond its threshold: below it
+    for negative thresholds, above it for positive ones. Samples are compared with the last
+    sample of the previous chunk, so crossings spanning chunk (or file) boundaries are found,
+    and crossings within refractory_period of the previous crossing of the same channel are
+    dropped. Detection is vectorized across channels.
+
+    Thresholds are given per channel (e.g. get_header_thresholds), or estimated as
+    -mad_factor times the robust noise level, median(|x|) / 0.6745, of each filtered channel
+    over the first noise_duration seconds of the stream. Channels given a NaN threshold get
+    the estimated one.
+
+    With snippet_window=(pre, post) in seconds, the filtered waveform around each crossing
+    is kept too, rounded to the dtype of the chunks (e.g. int16 counts). Snippets are spooled
+    to a temporary file, so only the crossing times are held in memory.
+
+    reset starts a new segment of the stream at the next chunk, e.g. after a gap in
+    acquisition time: the filter starts again in its steady state for the next sample, and
+    neither crossings, the refractory period nor snippets span the boundary. Snippets are
+    padded with the first or last sample of their segment instead.
+
+    Example:
+    detector = ThresholdDetector(30000., thresholds=get_header_thresholds(header, 0.195e-6))
+    for chunk in chunks:
+        detector(chunk)
+    detector.close()
+    times = detector.get_crossings(channel=0)
+    """
+
+    def __init__(self, sample_rate, thresholds=None, mad_factor=4.5, noise_duration=10., refractory_period=1e-3,
+                 highpass=300., snippet_window=None, tmp_dir=None, samples_per_pass=65536):
+        self.sample_rate = float(sample_rate)
+        self.thresholds = None if thresholds is None else np.asarray(thresholds, dtype=np.float64)
+        self.mad_factor = mad_factor
+        self.noise_samples = int(round(noise_duration * self.sample_rate))
+        self.refractory = int(round(refractory_period * self.sample_rate))
+        self.samples_per_pass = samples_per_pass
+        self.tmp_dir = tmp_dir
+        self.sos = None if highpass is None else butter(4, highpass, btype='highpass', output='sos', fs=self.sample_rate)
+        if snippet_window is None:
+            self.pre = self.post = None
+        else:
+            self.pre = int(round(snippet_window[0] * self.sample_rate))
+            self.post = int(round(snippet_window[1] * self.sample_rate))
+
+        self.zi = None
+        self.dtype = None
+        self.num_samples = 0           # samples filtered so far
+        self.num_detected = 0          # samples searched for crossings so far
+        self.noise = list()            # filtered samples kept to estimate thresholds
+        self.noise_segments = list()   # indices of the noise blocks starting a new segment
+        self.last = None               # last searched sample (polarity corrected)
+        self.last_crossing = None      # index of the last crossing of each channel
+        self.history = None            # last filtered samples, for snippets spanning chunks
+        self.pending = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        self.times = list()
+        self.channels = list()
+        self.spool = None
+        self.closed = False
+        self._crossings = None
+
+    def __call__(self, input):
+        """Searches the next chunk of the stream for crossings."""
+        if self.dtype is None:
+            self.dtype = input.dtype
+            if self.pre is not None:
+                self.spool = tempfile.TemporaryFile(prefix='rhd_snippets_', dir=self.tmp_dir)
+        for start in range(0, input.shape[0], self.samples_per_pass):
+            block = self._filter(input[start:start + self.samples_per_pass])
+            if self._needs_noise():
+                # Buffer the start of the stream until the noise level is known
+                self.noise.append(block.astype(np.float32))
+                if self.num_samples >= self.noise_samples:
+                    self._estimate_thresholds()
+            else:
+                self._detect(block)
+
+    def reset(self):
+        """Starts a new segment of the stream at the next chunk."""
+        self.zi = None
+        if self._needs_noise():
+            # Segments of the buffered noise are searched once the thresholds are known
+            if len(self.noise) > 0:
+                self.noise_segments.append(len(self.noise))
+        else:
+            self._end_segment()
+
+    def _end_segment(self):
+        """Keeps the snippets of the last crossings of the segment, and forgets the segment."""
+        if self.pre is not None and self.pending[0].shape[0] > 0:
+            # Pad the end of the segment with its last sample
+            padding = np.repeat(self.history[-1:], self.post, axis=0)
+            self._extract_snippets(padding, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        self.last = None
+        self.last_crossing = None
+        self.history = None
+
+    def _filter(self, block):
+        x = block.astype(np.float64)
+        self.num_samples += x.shape[0]
+        if self.sos is None:
+            return x
+        if self.zi is None:
+            # Steady state of the filter for a constant input equal to the first sample
+            self.zi = sosfilt_zi(self.sos)[:, :, None] * x[0]
+        x, self.zi = sosfilt(self.sos, x, axis=0, zi=self.zi)
+        return x
+
+    def _needs_noise(self):
+        return self.thresholds is None or np.isnan(self.thresholds).any()
+
+    def _estimate_thresholds(self):
+        bounds = [0] + self.noise_segments + [len(self.noise)]
+        segments = [np.concatenate(self.noise[start:stop]) for start, stop in zip(bounds[:-1], bounds[1:])]
+        noise = np.concatenate(segments) if len(segments) > 1 else segments[0]
+        self.noise = list()
+        self.noise_segments = list()
+        estimated = -self.mad_factor * np.median(np.abs(noise), axis=0) / 0.6745
+        if self.thresholds is None:
+            self.thresholds = estimated
+        else:
+            self.thresholds = np.where(np.isnan(self.thresholds), estimated, self.thresholds)
+        for ii, segment in enumerate(segments):
+            if ii > 0:
+                self._end_segment()
+            self._detect(segment.astype(np.float64))
+
+    def _detect(self, block):
+        num_samples, num_channels = block.shape
+        if self.last is None:
+            # Start of a segment: no crossing before, snippets padded with its first sample
+            self.last_crossing = np.full(num_channels, np.iinfo(np.int64).min // 2)
+            if self.pre is not None:
+                self.history = np.repeat(block[:1], self.pre + self.post, axis=0)
+
+        # Polarity corrected samples, crossing upwards through positive thresholds
+        polarity = np.where(self.thresholds < 0, -1., 1.)
+        levels = self.thresholds * polarity
+        beyond = block * polarity >= levels
+        previous = (block[:1] * polarity >= levels) if self.last is None else self.last
+        crossing = beyond & ~np.concatenate([previous, beyond[:-1]])
+        self.last = beyond[-1:]
+
+        # Crossings per channel, in time order
+        samples, channels = np.nonzero(crossing.T)[::-1]
+        times = samples.astype(np.int64) + self.num_detected
+        if times.shape[0] > 0:
+            times, channels = self._apply_refractory(times, channels)
+
+        if self.pre is None:
+            self.times.append(times)
+            self.channels.append(channels)
+        else:
+            self._extract_snippets(block, times, channels)
+        self.num_detected += num_samples
+
+    def _apply_refractory(self, times, channels):
+        """Drops the crossings within the refractory period of the previous kept crossing of their channel.
+
+        times and channels are sorted by channel, then time. A crossing further than the
+        refractory period from the previous crossing of its channel is always kept; only
+        the clusters of closer crossings are resolved one crossing after another.
+        """
+        first = np.concatenate([[True], channels[1:] != channels[:-1]])
+        previous_times = np.where(first, self.last_crossing[channels], np.roll(times, 1))
+        keep = times - previous_times >= self.refractory
+        for ii in np.flatnonzero(~keep & ~first):
+            # Last kept crossing of the channel before ii
+            jj = ii - 1
+            while jj >= 0 and channels[jj] == channels[ii] and not keep[jj]:
+                jj -= 1
+            if jj >= 0 and channels[jj] == channels[ii]:
+                last_kept = times[jj]
+            else:
+                last_kept = self.last_crossing[channels[ii]]
+            keep[ii] = times[ii] - last_kept >= self.refractory
+        times, channels = times[keep], channels[keep]
+
+        # Only kept crossings start a refractory period in the next chunks
+        if times.shape[0] > 0:
+            last = np.concatenate([channels[1:] != channels[:-1], [True]])
+            self.last_crossing[channels[last]] = times[last]
+        return times, channels
+
+    def _extract_snippets(self, block, times, channels):
+        """Spools the snippets of all crossings whose window ends within block."""
+        window = self.pre + self.post
+        extended = np.concatenate([self.history, block])
+        extended_start = self.num_detected - window
+        times = np.concatenate([self.pending[0], times])
+        channels = np.concatenate([self.pending[1], channels])
+        ready = times + self.post <= self.num_detected + block.shape[0]
+        self._spool_snippets(extended, extended_start, times[ready], channels[ready])
+        self.pending = (times[~ready], channels[~ready])
+        self.history = extended[-window:]
+
+    def _spool_snippets(self, extended, extended_start, times, channels):
+        if times.shape[0] == 0:
+            return
+        window = self.pre + self.post
+        offsets = times - self.pre - extended_start
+        snippets = extended[offsets[:, None] + np.arange(window), channels[:, None]]
+        if np.issubdtype(self.dtype, np.integer):
+            info = np.iinfo(self.dtype)
+            np.clip(np.rint(snippets, out=snippets), info.min, info.max, out=snippets)
+        self.spool.write(memoryview(np.ascontiguousarray(snippets, dtype=self.dtype)).cast('B'))
+        self.times.append(times)
+        self.channels.append(channels)
+
+    def close(self):
+        """Ends the stream: searches the buffered samples, and keeps the snippets of the last crossings."""
+        if self.closed:
+            return
+        self.closed = True
+        if len(self.noise) > 0:
+            self._estimate_thresholds()
+        if self.last is not None:
+            self._end_segment()
+
+    def get_crossings(self, channel):
+        """Returns the sample indices of the crossings of channel, and their snippets (or None)."""
+        self.close()
+        if self._crossings is None:
+            times = np.concatenate(self.times) if len(self.times) > 0 else np.zeros(0, dtype=np.int64)
+            channels = np.concatenate(self.channels) if len(self.channels) > 0 else np.zeros(0, dtype=np.int64)
+            self._crossings = times, channels
+        times, channels = self._crossings
+        index = np.flatnonzero(channels == channel)
+        if self.pre is None:
+            return times[index], None
+        if index.shape[0] == 0:
+            return times[index], np.zeros((0, self.pre + self.post), dtype=self.dtype)
+        self.spool.flush()
+        snippets = np.memmap(self.spool, dtype=self.dtype, mode='r', shape=(times.shape[0], self.pre + self.post))
+        return times[index], np.array(snippets[index])
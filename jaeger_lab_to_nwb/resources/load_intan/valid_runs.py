@@ -0,0 +1,129 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Runs of valid samples, flagged by a board digital input, in a session of Intan RHD2000 files
+# ------------------------------------------------------------------------------
+
+import numpy as np
+
+from .read_data_blocks import get_data_block_dtype
+from .session_index import RHDSessionIndex, index_rhd_file
+
+# Fields of the run table returned by get_valid_runs
+RUN_DTYPE = np.dtype([
+    ('file_index', np.int64),       # index of the file holding the run
+    ('file_start', np.int64),       # index of the first sample of the run in its file
+    ('file_stop', np.int64),        # index after the last sample of the run in its file
+    ('start_index', np.int64),      # index of the first sample of the run in the valid samples of the session
+    ('stop_index', np.int64),       # index after the last sample of the run in the valid samples of the session
+    ('num_samples', np.int64),
+    ('start_timestamp', np.int64),  # raw timestamp of the first sample
+    ('stop_timestamp', np.int64),   # raw timestamp of the last sample
+    ('start_time', np.float64),     # seconds
+    ('stop_time', np.float64),      # seconds, time of the last sample
+])
+
+
+def get_valid_runs(session, line=0):
+    """Splits the samples of a session of rhd files into runs of valid, contiguous samples.
+
+    session is a RHDSessionIndex, or a list of rhd files sorted in acquisition order. A sample
+    is valid when the board digital input number line (an index into board_dig_in_channels)
+    is high; with line=None, all samples are valid. Only the timestamps and packed digital
+    words are read. Run boundaries are found from the edges of the valid line, with a single
+    vectorized pass per file, and runs are also split at timestamp gaps and file boundaries,
+    so the samples of a run are contiguous both on disk and in acquisition time.
+
+    Returns a structured array with one row per run (see RUN_DTYPE), giving its sample range
+    in its file and in the valid samples of the session, and its first and last timestamps.
+    """
+
+    if isinstance(session, RHDSessionIndex):
+        entries = session.files
+    else:
+        entries = [index_rhd_file(filename) for filename in session]
+
+    sample_rate = entries[0]['header']['sample_rate']
+    runs = []
+    for file_index, entry in enumerate(entries):
+        if entry['num_data_blocks'] == 0:
+            continue
+        streams = [] if line is None else ['board_dig_in']
+        block_dtype = get_data_block_dtype(entry['header'], streams=streams)
+        blocks = np.memmap(entry['path'], dtype=block_dtype, mode='r', offset=entry['data_offset'],
+                           shape=(entry['num_data_blocks'],))
+        timestamps = blocks['timestamps'].reshape(-1).astype(np.int64)
+        num_samples = timestamps.shape[0]
+        if line is None:
+            valid = np.ones(num_samples, dtype=bool)
+        else:
+            native_order = entry['header']['board_dig_in_channels'][line]['native_order']
+            valid = np.not_equal(np.bitwise_and(blocks['board_dig_in'].reshape(-1), 1 << native_order), 0)
+
+        # Rising (+1) and falling (-1) edges of the valid line, with the file bounded by invalid samples
+        edges = np.diff(valid.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+        starts = np.flatnonzero(edges == 1)
+        stops = np.flatnonzero(edges == -1)
+
+        # Timestamp gaps within valid stretches also split runs
+        gaps = np.flatnonzero(np.not_equal(np.diff(timestamps), 1)) + 1
+        gaps = gaps[valid[gaps] & valid[gaps - 1]]
+        if gaps.shape[0] > 0:
+            starts = np.sort(np.concatenate([starts, gaps]))
+            stops = np.sort(np.concatenate([stops, gaps]))
+
+        file_runs = np.zeros(starts.shape[0], dtype=RUN_DTYPE)
+        file_runs['file_index'] = file_index
+        file_runs['file_start'] = starts
+        file_runs['file_stop'] = stops
+        file_runs['start_timestamp'] = timestamps[starts]
+        file_runs['stop_timestamp'] = timestamps[stops - 1]
+        runs.append(file_runs)
+
+    if len(runs) == 0:
+        return np.zeros(0, dtype=RUN_DTYPE)
+
+    runs = np.concatenate(runs)
+    runs['num_samples'] = runs['file_stop'] - runs['file_start']
+    runs['stop_index'] = np.cumsum(runs['num_samples'])
+    runs['start_index'] = runs['stop_index'] - runs['num_samples']
+    runs['start_time'] = runs['start_timestamp'] / sample_rate
+    runs['stop_time'] = runs['stop_timestamp'] / sample_rate
+
+    return runs
+
+
+def get_run_gaps(runs):
+    """Number of samples between the last timestamp of each run and the first of the next one.
+
+    Returns an array with one value per run: 0 for the first run, the number of samples skipped
+    (invalid) or missing from the files before the others, and negative values for timestamps
+    going backwards, e.g. after a reset. With the runs of all samples (line=None), merged with
+    merge_runs, each run is a segment of contiguous timestamps, and its gap is the size of the
+    discontinuity preceding it.
+    """
+
+    gaps = np.zeros(runs.shape[0], dtype=np.int64)
+    gaps[1:] = runs['start_timestamp'][1:] - runs['stop_timestamp'][:-1] - 1
+    return gaps
+
+
+def merge_runs(runs):
+    """Merges the runs that carry on each other in acquisition time, e.g. across file boundaries.
+
+    A run carries on the previous one when its first timestamp follows the last timestamp of
+    the previous one. The file fields of a merged run are those of its first run.
+    """
+
+    if runs.shape[0] == 0:
+        return runs
+    carry_on = np.equal(runs['start_timestamp'][1:], runs['stop_timestamp'][:-1] + 1)
+    first = np.flatnonzero(np.concatenate([[True], ~carry_on]))
+    last = np.append(first[1:], runs.shape[0]) - 1
+
+    merged = runs[first].copy()
+    merged['stop_index'] = runs['stop_index'][last]
+    merged['num_samples'] = merged['stop_index'] - merged['start_index']
+    merged['stop_timestamp'] = runs['stop_timestamp'][last]
+    merged['stop_time'] = runs['stop_time'][last]
+    return merged
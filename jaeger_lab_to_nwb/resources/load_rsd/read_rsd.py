@@ -0,0 +1,42 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Memory-mapped access to the .rsd raw data files of the FRET cortical imaging system
+# ------------------------------------------------------------------------------
+
+import os
+import numpy as np
+
+# Each frame is stored as 12800 int16 words, column after column of a 128 x 100 array:
+# rows 0 to 19 hold the excess data (analog inputs, triggers), rows 20 to 119 the image
+FRAME_ROWS = 128
+FRAME_COLUMNS = 100
+FRAME_WORDS = FRAME_ROWS * FRAME_COLUMNS
+
+
+def read_rsd_frames(filename):
+    """Maps the frames of a .rsd file as a (frames, 128, 100) int16 array, without reading or copying them.
+
+    The file is memory-mapped, and the frames are a transposed view of its words, so the
+    returned array uses no memory until its values are accessed: files of any size are
+    read in whole frames, as slices of the array are accessed.
+    """
+    num_bytes = os.path.getsize(filename)
+    if num_bytes % (2 * FRAME_WORDS) != 0:
+        raise Exception('Something is wrong with file size of {} : should have a whole number of frames '
+                        '({} bytes each)'.format(filename, 2 * FRAME_WORDS))
+    num_frames = num_bytes // (2 * FRAME_WORDS)
+    if num_frames == 0:
+        return np.zeros((0, FRAME_ROWS, FRAME_COLUMNS), dtype=np.int16)
+    words = np.memmap(filename, dtype='<i2', mode='r', shape=(num_frames * FRAME_WORDS,))
+    # Column-major frames: (frames, columns, rows) in file order, viewed as (frames, rows, columns)
+    return words.reshape(num_frames, FRAME_COLUMNS, FRAME_ROWS).transpose(0, 2, 1)
+
+
+def split_frames(raw_frames):
+    """Splits (frames, 128, 100) raw frames into the (frames, 100, 100) image stack and the (frames, 20, 100) excess stack.
+
+    Words are stored negated: both stacks are views of a single negated copy of raw_frames.
+    """
+    frames = np.negative(raw_frames)
+    return frames[:, 20:120, :], frames[:, 0:20, :]
@@ -0,0 +1,110 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab
+# Index of the .rsh headers of a FRET cortical imaging session, persisted as a sidecar file
+# ------------------------------------------------------------------------------
+
+from datetime import datetime
+from pathlib import Path
+
+from ..file_index import get_file_stat, index_files
+
+# Name of the sidecar file written next to the rsh files
+INDEX_FILENAME = 'rsd_session_index.json'
+INDEX_VERSION = 1
+
+ACQUISITION_DATE_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+
+def read_rsh(filename):
+    """Parses a .rsh header file in a single read.
+
+    Returns a dictionary with the acquisition date (as written in the header), the sample
+    rate in Hz, the number of frames per page, the .rsm file (bitmap of monitor) and the
+    list of .rsd files (raw data), which follow the Data-File-List line.
+    """
+    with open(filename, 'r') as f:
+        lines = f.read().splitlines()
+
+    fields = dict()
+    files = []
+    for ii, line in enumerate(lines):
+        if 'Data-File-List' in line:
+            files = [name.strip() for name in lines[ii + 1:] if name.strip() != '']
+            break
+        key, _, value = line.partition('=')
+        fields[key.strip()] = value.strip()
+
+    sample_time = float(fields['sample_time'].replace('msec', '').strip()) / 1000.
+    return dict(
+        acquisition_date=fields['acquisition_date'],
+        sample_rate=1 / sample_time,
+        n_frames=int(fields['page_frames']),
+        file_rsm=files[0],
+        files_raw=files[1:]
+    )
+
+
+def index_rsh_file(filename):
+    """Parses one .rsh header file, with the file path, size and modification time."""
+    stat = get_file_stat(filename)
+    return dict(**read_rsh(stat['path']), **stat)
+
+
+class FRETSession(object):
+    """Index of all trials of a FRET session, built from the .rsh headers of a directory.
+
+    Each trial XXXXXXXXX-<trial> has a session header (XXXXXXXXX-<trial>.rsh) and one header
+    per channel: XXXXXXXXX-<trial>_A.rsh for the donor and XXXXXXXXX-<trial>_B.rsh for the
+    acceptor, listing the .rsd raw data files of the channel. Headers are parsed once, and
+    kept in a sidecar file (rsd_session_index.json in the same directory, by default, see
+    index_files), so the index of a known session is loaded without parsing any header.
+
+    Example:
+    session = FRETSession(dir_cortical_imaging)
+    session.session_start_time
+    for trial in session.trials:
+        session.get_channel(trial, 'A')['files_raw'], session.get_channel(trial, 'A')['sample_rate']
+    """
+
+    def __init__(self, dir_cortical_imaging, index_file=None, persist=True):
+        self.dir_cortical_imaging = Path(dir_cortical_imaging)
+        if index_file is None:
+            index_file = self.dir_cortical_imaging / INDEX_FILENAME
+        self.index_file = Path(index_file)
+
+        entries = index_files(sorted(self.dir_cortical_imaging.glob('*.rsh')), index_rsh_file, self.index_file,
+                              INDEX_VERSION, persist=persist)
+        if len(entries) == 0:
+            raise OSError(f"No .rsh file found in directory: {self.dir_cortical_imaging}.\n"
+                          "Did you choose the correct path for source data?")
+        self.headers = {Path(entry['path']).name: entry for entry in entries}
+
+        # Trials are numbered by the session headers, XXXXXXXXX-<trial>.rsh
+        self.fname_prefix = next(iter(self.headers)).split('-')[0]
+        session_headers = [name for name in self.headers if ('_A' not in name) and ('_B' not in name)]
+        self.trials = [name.split('-')[1].replace('.rsh', '') for name in session_headers]
+
+    def __len__(self):
+        return len(self.trials)
+
+    def get_header(self, trial):
+        """Session header of trial."""
+        return self.headers[f"{self.fname_prefix}-{trial}.rsh"]
+
+    def get_channel(self, trial, channel):
+        """Header of channel ('A' for the donor, 'B' for the acceptor) of trial."""
+        return self.headers[f"{self.fname_prefix}-{trial}_{channel}.rsh"]
+
+    def get_raw_files(self, trial, channel):
+        """Paths of the .rsd raw data files of channel of trial, in acquisition order."""
+        return [str(self.dir_cortical_imaging / fraw) for fraw in self.get_channel(trial, channel)['files_raw']]
+
+    def get_start_time(self, trial, channel='A'):
+        """Acquisition time of channel of trial, as a naive datetime."""
+        return datetime.strptime(self.get_channel(trial, channel)['acquisition_date'], ACQUISITION_DATE_FORMAT)
+
+    @property
+    def session_start_time(self):
+        """Acquisition time of the first trial, as a naive datetime."""
+        return datetime.strptime(self.get_header(self.trials[0])['acquisition_date'], ACQUISITION_DATE_FORMAT)
@@ -0,0 +1,114 @@
+# Written for Jaeger Lab
+# HDF5 chunking and compression options for the datasets written by the data interfaces
+# ------------------------------------------------------------------------------
+from hdmf.backends.hdf5 import H5DataIO
+
+BLOSC_CODECS = ['blosclz', 'lz4', 'lz4hc', 'snappy', 'zlib', 'zstd']
+
+
+def get_write_options_schema():
+    """Return the JSON schema of the write options of one data interface."""
+    return dict(
+        type="object",
+        additionalProperties=False,
+        properties=dict(
+            chunk_shape=dict(
+                type="array",
+                items=dict(type="integer", minimum=1),
+                description="HDF5 chunk shape, e.g. [time, channels]. By default, recommended by the "
+                            "data iterator or guessed by h5py."
+            ),
+            compression=dict(
+                type="string",
+                enum=["gzip", "lzf", "blosc"],
+                description="Compression filter. 'blosc' requires the hdf5plugin package. By default, "
+                            "data are not compressed."
+            ),
+            compression_opts=dict(
+                type="integer",
+                minimum=0,
+                maximum=9,
+                description="Compression level, for gzip and blosc."
+            ),
+            shuffle=dict(
+                type="boolean",
+                description="Apply the shuffle filter before compression."
+            ),
+            blosc_codec=dict(
+                type="string",
+                enum=BLOSC_CODECS,
+                description="Compressor used inside blosc. Defaults to zstd."
+            )
+        )
+    )
+
+
+def get_write_options(metadata: dict, interface_name: str, write_options: dict = None):
+    """
+    Collect the write options of one data interface.
+
+    Options are taken from metadata['WriteOptions'], where the 'default' entry applies to
+    all interfaces and the entry named after the interface (e.g. 'IntanDataInterface')
+    overrides it. Options given in write_options override both.
+    """
+    meta_write_options = metadata.get('WriteOptions', dict())
+    options = dict(meta_write_options.get('default', dict()))
+    options.update(meta_write_options.get(interface_name, dict()))
+    if write_options is not None:
+        options.update(write_options)
+    return options
+
+
+def wrap_data(data, write_options: dict = None):
+    """
+    Wrap data in a H5DataIO with the given chunking and compression options.
+
+    Data are returned unchanged if no option is set. A chunk shape with more dimensions
+    than data is not applied.
+    """
+    if not write_options:
+        return data
+
+    io_kwargs = dict()
+    chunk_shape = write_options.get('chunk_shape')
+    if chunk_shape is not None and _get_ndim(data) == len(chunk_shape):
+        io_kwargs['chunks'] = tuple(chunk_shape)
+
+    compression = write_options.get('compression')
+    if compression == 'gzip':
+        io_kwargs['compression'] = 'gzip'
+        io_kwargs['compression_opts'] = write_options.get('compression_opts', 4)
+    elif compression == 'lzf':
+        io_kwargs['compression'] = 'lzf'
+    elif compression == 'blosc':
+        try:
+            import hdf5plugin
+        except ImportError:
+            raise ImportError("Blosc compression requires the hdf5plugin package: pip install hdf5plugin")
+        blosc = hdf5plugin.Blosc(
+            cname=write_options.get('blosc_codec', 'zstd'),
+            clevel=write_options.get('compression_opts', 5),
+            shuffle=hdf5plugin.Blosc.SHUFFLE if write_options.get('shuffle', True) else hdf5plugin.Blosc.NOSHUFFLE
+        )
+        io_kwargs['compression'] = blosc.filter_id
+        io_kwargs['compression_opts'] = blosc.filter_options
+        io_kwargs['allow_plugin_filters'] = True
+    elif compression is not None:
+        raise ValueError(f"Unknown compression: {compression}. Supported compressions are 'gzip', 'lzf' and 'blosc'.")
+
+    # Blosc shuffles bytes itself, the HDF5 shuffle filter only goes with gzip and lzf
+    if compression != 'blosc' and write_options.get('shuffle', False):
+        io_kwargs['shuffle'] = True
+
+    if len(io_kwargs) == 0:
+        return data
+    return H5DataIO(data, **io_kwargs)
+
+
+def _get_ndim(data):
+    """Number of dimensions of an array or a data chunk iterator."""
+    if hasattr(data, 'maxshape'):
+        return len(data.maxshape)
+    if hasattr(data, 'ndim'):
+        return data.ndim
+    return len(getattr(data, 'shape', ()))
@@ -1,16 +1,51 @@
-from jaeger_lab_to_nwb.resources.load_intan import load_intan, read_header
+from jaeger_lab_to_nwb.resources.load_intan.session_index import RHDSessionIndex
+from jaeger_lab_to_nwb.resources.load_intan.read_data_blocks import get_stream_conversion, get_stream_decimation
+from jaeger_lab_to_nwb.resources.load_intan.valid_runs import get_valid_runs, merge_runs, get_run_gaps
+from jaeger_lab_to_nwb.resources.load_intan.digital_edges import get_digital_edges
+from jaeger_lab_to_nwb.resources.load_intan.lfp_filter import LFPFilter, Decimator
+from jaeger_lab_to_nwb.resources.load_intan.channel_qc import ChannelQC, QC_METRICS
+from jaeger_lab_to_nwb.resources.load_intan.dat_writer import DatWriter
+from jaeger_lab_to_nwb.resources.load_intan.threshold_crossings import ThresholdDetector, get_header_thresholds
+from jaeger_lab_to_nwb.resources.write_options import get_write_options_schema, get_write_options, wrap_data
+from .rhddatachunkiterator import RHDSessionReader, RHDSummaryIterator, RHDEventIterator
 from nwb_conversion_tools.basedatainterface import BaseDataInterface
 from nwb_conversion_tools.utils import get_schema_from_hdmf_class
 from nwb_conversion_tools.json_schema_utils import get_base_schema
 
-from pynwb import NWBFile
+from pynwb import NWBFile, TimeSeries
+from pynwb.epoch import TimeIntervals
+from pynwb.file import ElectrodeTable
+from hdmf.common import DynamicTableRegion
 from pynwb.device import Device
-from pynwb.ecephys import ElectricalSeries, ElectrodeGroup
-from hdmf.data_utils import DataChunkIterator
+from pynwb.ecephys import ElectricalSeries, ElectrodeGroup, LFP, SpikeEventSeries
+from ndx_events import TTLs
 from pathlib import Path
 import pandas as pd
 import numpy as np
 
+# Descriptions of the electrodes table columns, for the pynwb versions that add them on demand
+ELECTRODE_COLUMNS = dict(
+    x='x coordinate of the channel location in the brain',
+    y='y coordinate of the channel location in the brain',
+    z='z coordinate of the channel location in the brain',
+    imp='the impedance of the channel, in ohms',
+    location='the location of channel within the subject e.g. brain region',
+    filtering='description of hardware filtering, including the filter name and frequency cutoffs',
+    group='a reference to the ElectrodeGroup this electrode is a part of',
+    group_name='the name of the ElectrodeGroup this electrode is a part of'
+)
+
+# Default description and unit of the auxiliary streams written as TimeSeries
+AUXILIARY_STREAMS = dict(
+    aux_input=dict(description="Auxiliary inputs of the amplifier boards.", unit='volts'),
+    board_adc=dict(description="Analog inputs of the interface board.", unit='volts'),
+    supply_voltage=dict(description="Supply voltage of the amplifier boards.", unit='volts'),
+    temp_sensor=dict(description="Temperature sensors of the interface board.", unit='degrees Celsius')
+)
+
+# Waveform snippets of threshold crossings, in seconds before and after the crossing
+SNIPPET_WINDOW = (0.5e-3, 1e-3)
+
 
 class IntanDataInterface(BaseDataInterface):
     """Conversion class for intan data."""
@@ -44,18 +79,29 @@ class IntanDataInterface(BaseDataInterface):
         metadata_schema['properties']['Ecephys']['properties'] = dict(
             Device=get_schema_from_hdmf_class(Device),
             ElectricalSeries=get_schema_from_hdmf_class(ElectricalSeries),
+            LFPElectricalSeries=get_schema_from_hdmf_class(ElectricalSeries),
         )
+        for stream in AUXILIARY_STREAMS:
+            metadata_schema['properties']['Ecephys']['properties']['TimeSeries_' + stream] = \
+                get_schema_from_hdmf_class(TimeSeries)
+
+        # Write options schema
+        metadata_schema['properties']['WriteOptions'] = get_base_schema()
+        metadata_schema['properties']['WriteOptions']['properties'] = {
+            'default': get_write_options_schema(),
+            self.__class__.__name__: get_write_options_schema()
+        }
         return metadata_schema
 
+    def get_session_index(self):
+        """Header-only index of the rhd files, cached in a sidecar file of dir_ecephys_rhd."""
+        return RHDSessionIndex(self.source_data['dir_ecephys_rhd'])
+
     def get_metadata(self):
         """Get initial metadata"""
         # Gets header data from first file
-        dir_ecephys_rhd = self.source_data['dir_ecephys_rhd']
-        all_files = [str(file.resolve()) for file in Path(dir_ecephys_rhd).glob("*.rhd")]
-        all_files.sort()
-        fid = open(all_files[0], 'rb')
-        header = read_header.read_header(fid)
-        sampling_rate = header['sample_rate']
+        session_index = self.get_session_index()
+        sampling_rate = session_index.sample_rate
 
         metadata = dict(
             Ecephys=dict(
@@ -66,12 +112,31 @@ class IntanDataInterface(BaseDataInterface):
                     name='ElectricalSeries',
                     description="Raw acquisition traces.",
                     rate=sampling_rate
+                ),
+                LFPElectricalSeries=dict(
+                    name='ElectricalSeries_lfp',
+                    description="Local field potentials: low-pass filtered and decimated raw traces."
                 )
             )
         )
+        for stream in self.get_auxiliary_streams(session_index.header):
+            metadata['Ecephys']['TimeSeries_' + stream] = dict(
+                name='TimeSeries_' + stream,
+                description=AUXILIARY_STREAMS[stream]['description'],
+                unit=AUXILIARY_STREAMS[stream]['unit']
+            )
         return metadata
 
-    def run_conversion(self, nwbfile: NWBFile, metadata: dict):
+    @staticmethod
+    def get_auxiliary_streams(header):
+        """Names of the auxiliary streams with enabled channels in the rhd files."""
+        return [stream for stream in AUXILIARY_STREAMS if header['num_' + stream + '_channels'] > 0]
+
+    def run_conversion(self, nwbfile: NWBFile, metadata: dict, digital_output: str = None, num_workers: int = 1,
+                       max_pending_files: int = None, auxiliary_streams: list = None, add_lfp: bool = False,
+                       lfp_rate: float = 1000., lfp_cutoff: float = 300., add_qc: bool = False, file_qc: str = None,
+                       file_dat: str = None, threshold: str = None, mad_factor: float = 4.5,
+                       refractory_period: float = 1e-3, add_snippets: bool = False, write_options: dict = None):
         """
         Run conversion for this data interface.
         Reads ecephys data from rhd files and adds it to nwbfile.
@@ -80,19 +145,61 @@ class IntanDataInterface(BaseDataInterface):
         ----------
         nwbfile : NWBFile
         metadata : dict
+        digital_output : str, optional
+            'events' adds the rising and falling edges of the board digital inputs
+            as a TTLs table. By default, digital inputs are not written.
+        num_workers : int, optional
+            Number of worker processes decoding upcoming rhd files while the current one
+            is written. By default, files are decoded one after another.
+        max_pending_files : int, optional
+            Maximum number of files decoded ahead of the writer, to bound the temporary
+            disk and memory in use. By default, twice the number of workers.
+        auxiliary_streams : list, optional
+            Auxiliary streams written as TimeSeries at their own rate, among 'aux_input',
+            'board_adc', 'supply_voltage' and 'temp_sensor'. They are read in the same pass
+            as the amplifier data. By default, all streams with enabled channels.
+        add_lfp : bool, optional
+            Adds local field potentials to the 'ecephys' processing module, computed from the
+            amplifier data in the same pass by a causal Butterworth low-pass filter and decimation,
+            with the filter state carried across files. Default is False.
+        lfp_rate : float, optional
+            Sampling rate of the LFP, in Hz. Must divide the sampling rate. Default is 1000.
+        lfp_cutoff : float, optional
+            Cutoff frequency of the LFP low-pass filter, in Hz. Default is 300.
+        add_qc : bool, optional
+            Computes per-channel quality metrics of the amplifier data in the same pass (mean,
+            standard deviation, RMS, saturated samples, flat lines and 50/60 Hz line noise), and
+            adds them as qc_* columns of the electrodes table. Default is False.
+        file_qc : str, optional
+            Path of the JSON summary of the quality metrics. By default, ecephys_qc.json in
+            dir_ecephys_rhd.
+        file_dat : str, optional
+            Path of a flat binary copy of the amplifier data written in the same pass (int16 samples,
+            interleaved channels, e.g. for Kilosort), with a JSON sidecar of the same name holding
+            the sampling rate, conversion to volts and channel map. By default, not written.
+        threshold : str, optional
+            Detects threshold crossings of the high-pass filtered (300 Hz) amplifier data in the same
+            pass, and adds them to the 'ecephys' processing module, as one SpikeEventSeries per channel
+            (ThresholdCrossings_<channel name>).
+            'header' uses the Spike Scope thresholds of the rhd header, 'mad' the median absolute
+            deviation of the first 10 s of each channel times mad_factor. With 'header', channels
+            without a voltage trigger threshold (digital trigger, or a threshold of 0) use the 'mad'
+            threshold. By default, no detection.
+        mad_factor : float, optional
+            Threshold in units of the robust noise level, for threshold='mad'. Default is 4.5.
+        refractory_period : float, optional
+            Crossings within refractory_period seconds of the previous crossing of the same channel
+            are dropped. Default is 1 ms.
+        add_snippets : bool, optional
+            Keeps the filtered waveform from 0.5 ms before to 1 ms after each crossing. By default,
+            only the filtered sample at the crossing is kept.
+        write_options : dict, optional
+            HDF5 chunking and compression options of the amplifier data, with keys chunk_shape,
+            compression ('gzip', 'lzf' or 'blosc'), compression_opts, shuffle and blosc_codec.
+            Overrides the options found in metadata['WriteOptions']. The auxiliary streams
+            and LFP are written with the same options, but their own chunk shape.
         """
-        def data_gen(all_files):
-            n_files = len(all_files)
-            # Iterates over all files within the directory
-            for ii, fname in enumerate(all_files):
-                print("Converting ecephys rhd data: {}%".format(100 * ii / n_files))
-                file_data = load_intan.read_data(filename=fname)
-                # Gets only valid timestamps
-                valid_ts = file_data['board_dig_in_data'][0]
-                analog_data = file_data['amplifier_data'][:, valid_ts]
-                n_samples = analog_data.shape[1]
-                for sample in range(n_samples):
-                    yield analog_data[:, sample]
+        write_options = get_write_options(metadata, self.__class__.__name__, write_options)
 
         # Adds Device
         device = nwbfile.create_device(name=metadata['Ecephys']['Device']['name'])
@@ -107,66 +214,381 @@ class IntanDataInterface(BaseDataInterface):
                 device=device
             )
 
-        # Gets electrodes info from first rhd file
-        dir_ecephys_rhd = self.source_data['dir_ecephys_rhd']
-        all_files = [str(file.resolve()) for file in Path(dir_ecephys_rhd).glob("*.rhd")]
-        all_files.sort()
-        file_data = load_intan.read_data(filename=all_files[0])
-        electrodes_info = file_data['amplifier_channels']
+        # Gets electrodes info from first rhd file header
+        session_index = self.get_session_index()
+        all_files = session_index.filenames
+        electrodes_info = session_index.amplifier_channels
         n_electrodes = len(electrodes_info)
 
-        # Electrodes
+        # Electrodes, one row per amplifier channel of the header
+        df_channels = pd.DataFrame(electrodes_info)
         file_electrodes = self.source_data.get('file_electrodes', None)
         if file_electrodes is not None:  # if an electrodes info file was provided
             df_electrodes = pd.read_csv(file_electrodes, index_col='Channel Number')
-            for idx, elec in enumerate(electrodes_info):
-                elec_name = elec['native_channel_name']
-                elec_group = df_electrodes.loc[elec_name]['electrode_group']
-                elec_imp = df_electrodes.loc[elec_name]['Impedance Magnitude at 1000 Hz (ohms)']
-                nwbfile.add_electrode(
-                    id=idx,
-                    x=np.nan, y=np.nan, z=np.nan,
-                    imp=float(elec_imp),
-                    location='location',
-                    filtering='none',
-                    group=nwbfile.electrode_groups[elec_group]
-                )
-        else:  # if no electrodes file info was provided
+            df_channels = df_channels.join(df_electrodes, on='native_channel_name')
+            missing = df_channels['electrode_group'].isna()
+            if missing.any():
+                raise ValueError("Channels missing from {}: {}".format(
+                    file_electrodes, list(df_channels['native_channel_name'][missing])))
+            groups = [nwbfile.electrode_groups[name] for name in df_channels['electrode_group']]
+            impedances = df_channels['Impedance Magnitude at 1000 Hz (ohms)'].to_numpy(dtype=float)
+        else:  # if no electrodes file info was provided, impedances are taken from the header
             first_el_grp = list(nwbfile.electrode_groups.keys())[0]
-            electrode_group = nwbfile.electrode_groups[first_el_grp]
-            for idx in range(n_electrodes):
-                nwbfile.add_electrode(
-                    id=idx,
-                    x=np.nan, y=np.nan, z=np.nan,
-                    imp=np.nan,
-                    location='location',
-                    filtering='none',
-                    group=electrode_group
-                )
+            groups = [nwbfile.electrode_groups[first_el_grp]] * n_electrodes
+            impedances = df_channels['electrode_impedance_magnitude'].to_numpy(dtype=float)
 
-        electrode_table_region = nwbfile.create_electrode_table_region(
-            region=list(np.arange(n_electrodes)),
-            description='no description'
+        self.add_electrodes(
+            nwbfile=nwbfile,
+            columns=dict(
+                x=np.full(n_electrodes, np.nan),
+                y=np.full(n_electrodes, np.nan),
+                z=np.full(n_electrodes, np.nan),
+                imp=impedances,
+                location=['location'] * n_electrodes,
+                filtering=['none'] * n_electrodes,
+                group=groups,
+                group_name=[group.name for group in groups]
+            )
         )
 
-        # Create iterator
-        data_iter = DataChunkIterator(
-            data=data_gen(all_files=all_files),
-            iter_axis=0,
-            buffer_size=10000,
-            maxshape=(None, n_electrodes)
+        electrode_table_region = DynamicTableRegion(
+            name='electrodes',
+            data=np.arange(n_electrodes),
+            description='no description',
+            table=nwbfile.electrodes
+        )
+
+        # Runs of valid samples (board digital input 0 high) with contiguous timestamps
+        runs = get_valid_runs(session_index, line=0)
+
+        # Timing: valid samples contiguous in time start at their first timestamp,
+        # otherwise timestamps are written for every sample
+        contiguous_runs = merge_runs(runs)
+        write_timestamps = len(contiguous_runs) > 1
+        if write_timestamps:
+            num_skipped = np.maximum(get_run_gaps(contiguous_runs), 0).sum()
+            print("Found {} discontinuities in valid ecephys rhd samples ({} samples skipped or missing), "
+                  "writing timestamps.".format(len(contiguous_runs) - 1, num_skipped))
+
+        if auxiliary_streams is None:
+            auxiliary_streams = self.get_auxiliary_streams(session_index.header)
+        keys = ['amplifier_data'] + [stream + '_data' for stream in auxiliary_streams]
+        if write_timestamps:
+            keys += ['t_amplifier'] + ['t_' + stream for stream in auxiliary_streams]
+
+        # Gets electricalseries conversion factor and offset to Volts, of the int16 samples (raw - 32768)
+        es_conversion_factor, es_offset = get_stream_conversion('amplifier', session_index.header)
+        es_offset += 32768 * es_conversion_factor
+        scaling = dict(conversion=es_conversion_factor)
+        if es_offset != 0:
+            # TimeSeries offset is only known to pynwb >= 2.1
+            scaling['offset'] = es_offset
+
+        # LFP, filtered from the amplifier data as it is read
+        derived = dict()
+        if add_lfp:
+            lfp_decimation = int(round(session_index.sample_rate / lfp_rate))
+            if lfp_decimation < 1 or not np.isclose(session_index.sample_rate / lfp_decimation, lfp_rate):
+                raise ValueError("lfp_rate ({} Hz) must divide the sampling rate ({} Hz).".format(
+                    lfp_rate, session_index.sample_rate))
+            derived['lfp_data'] = ('amplifier_data', LFPFilter(session_index.sample_rate, lfp_decimation,
+                                                               cutoff=lfp_cutoff))
+            if write_timestamps:
+                derived['t_lfp'] = ('t_amplifier', Decimator(lfp_decimation))
+
+        # Quality metrics, accumulated from the amplifier data as it is read
+        observers = list()
+        if add_qc:
+            channel_qc = ChannelQC(session_index.sample_rate, conversion=es_conversion_factor, offset=es_offset)
+            observers.append(('amplifier_data', channel_qc))
+        if file_dat is not None:
+            observers.append(('amplifier_data', DatWriter(
+                filename=file_dat,
+                sample_rate=session_index.sample_rate,
+                conversion=es_conversion_factor,
+                offset=es_offset,
+                probe=dict(
+                    channel_map=list(range(n_electrodes)),
+                    channel_names=list(df_channels['native_channel_name']),
+                    electrode_groups=[group.name for group in groups],
+                    kcoords=[list(nwbfile.electrode_groups).index(group.name) for group in groups]
+                )
+            )))
+
+        # Threshold crossings, detected in the amplifier data as it is read
+        if threshold is not None:
+            if threshold == 'header':
+                thresholds = get_header_thresholds(session_index.header, es_conversion_factor)
+            elif threshold == 'mad':
+                thresholds = None
+            else:
+                raise ValueError(f"Unknown threshold: {threshold}. Supported thresholds are 'header' and 'mad'.")
+            detector = ThresholdDetector(
+                sample_rate=session_index.sample_rate,
+                thresholds=thresholds,
+                mad_factor=mad_factor,
+                refractory_period=refractory_period,
+                snippet_window=SNIPPET_WINDOW if add_snippets else (0., 1. / session_index.sample_rate)
+            )
+            observers.append(('amplifier_data', detector))
+
+        # Streams centered on 32768 (amplifier, and board ADC in some eval board modes) are
+        # written as int16 samples, so that their offset is 0
+        signed_keys = ['amplifier_data'] + [stream + '_data' for stream in auxiliary_streams
+                                            if get_stream_conversion(stream, session_index.header)[1] != 0]
+
+        # Single pass over the rhd files, feeding one iterator per array, in large blocks
+        # of valid samples, as native 16-bit samples
+        reader = RHDSessionReader(
+            filenames=all_files,
+            keys=keys,
+            runs=runs,
+            derived=derived,
+            observers=observers,
+            compact=True,
+            signed_keys=signed_keys,
+            num_workers=num_workers,
+            max_pending_files=max_pending_files,
+            print_progress=True
         )
+        data_iter = reader.get_iterator('amplifier_data')
+
+        if write_timestamps:
+            timing = dict(timestamps=reader.get_iterator('t_amplifier'))
+        else:
+            timing = dict(
+                rate=float(metadata['Ecephys']['ElectricalSeries']['rate']),
+                starting_time=float(contiguous_runs['start_time'][0]) if len(contiguous_runs) > 0 else 0.0
+            )
 
         # Electrical Series
-        # Gets electricalseries conversion factor
-        es_conversion_factor = file_data['amplifier_data_conversion_factor']
         ephys_ts = ElectricalSeries(
             name=metadata['Ecephys']['ElectricalSeries']['name'],
             description=metadata['Ecephys']['ElectricalSeries']['description'],
-            data=data_iter,
+            data=wrap_data(data_iter, write_options),
             electrodes=electrode_table_region,
-            rate=float(metadata['Ecephys']['ElectricalSeries']['rate']),
-            starting_time=0.0,
-            conversion=es_conversion_factor
+            **scaling,
+            **timing
         )
         nwbfile.add_acquisition(ephys_ts)
+
+        # Auxiliary streams, at their own rate
+        stream_write_options = {k: v for k, v in write_options.items() if k != 'chunk_shape'}
+        for stream in auxiliary_streams:
+            key = stream + '_data'
+            if reader.get_num_samples(key) == 0:
+                reader.finish(key)
+                reader.finish('t_' + stream)
+                continue
+            decimation = get_stream_decimation(stream, session_index.header)
+            if write_timestamps:
+                aux_timing = dict(timestamps=reader.get_iterator('t_' + stream))
+            else:
+                # First sample of the stream at or after the first valid amplifier sample
+                skipped = -contiguous_runs['file_start'][0] % decimation
+                aux_timing = dict(
+                    rate=session_index.sample_rate / decimation,
+                    starting_time=float(contiguous_runs['start_timestamp'][0] + skipped) / session_index.sample_rate
+                )
+            # The offset is 0: streams with a nonzero offset are read as signed samples (see signed_keys)
+            conversion_factor, _ = get_stream_conversion(stream, session_index.header)
+            meta_ts = dict(name='TimeSeries_' + stream, **AUXILIARY_STREAMS[stream])
+            meta_ts.update(metadata['Ecephys'].get('TimeSeries_' + stream, dict()))
+            nwbfile.add_acquisition(TimeSeries(
+                name=meta_ts['name'],
+                description=meta_ts['description'],
+                data=wrap_data(reader.get_iterator(key), stream_write_options),
+                unit=meta_ts['unit'],
+                conversion=conversion_factor,
+                **aux_timing
+            ))
+
+        # Local field potentials
+        if add_lfp:
+            if write_timestamps:
+                lfp_timing = dict(timestamps=reader.get_iterator('t_lfp'))
+            else:
+                lfp_timing = dict(
+                    rate=session_index.sample_rate / lfp_decimation,
+                    starting_time=timing['starting_time']
+                )
+            lfp_ts = ElectricalSeries(
+                name=metadata['Ecephys']['LFPElectricalSeries']['name'],
+                description=metadata['Ecephys']['LFPElectricalSeries']['description'] +
+                " Causal order 4 Butterworth low-pass filter at {} Hz, restarted with the decimation"
+                " after each discontinuity in the timestamps.".format(lfp_cutoff),
+                data=wrap_data(reader.get_iterator('lfp_data'), stream_write_options),
+                electrodes=electrode_table_region,
+                **scaling,
+                **lfp_timing
+            )
+            self.get_ecephys_module(nwbfile).add(LFP(electrical_series=lfp_ts))
+
+        if threshold is not None:
+            self.add_threshold_crossings(
+                nwbfile=nwbfile,
+                reader=reader,
+                detector=detector,
+                runs=runs,
+                sample_rate=session_index.sample_rate,
+                channel_names=list(df_channels['native_channel_name']),
+                scaling=scaling
+            )
+
+        if add_qc:
+            if file_qc is None:
+                file_qc = Path(self.source_data['dir_ecephys_rhd']) / 'ecephys_qc.json'
+            self.add_qc_columns(
+                nwbfile=nwbfile,
+                reader=reader,
+                channel_qc=channel_qc,
+                file_qc=file_qc,
+                channel_names=list(df_channels['native_channel_name'])
+            )
+
+        self.add_valid_runs(nwbfile=nwbfile, runs=contiguous_runs, sample_rate=session_index.sample_rate)
+
+        # Digital inputs
+        if digital_output == 'events':
+            self.add_digital_events(nwbfile=nwbfile, all_files=all_files)
+        elif digital_output is not None:
+            raise ValueError(f"Unknown digital_output: {digital_output}. Supported output is 'events'.")
+
+    def add_electrodes(self, nwbfile: NWBFile, columns: dict):
+        """Adds electrodes to nwbfile in bulk, from columns of values mapped by column name."""
+        if nwbfile.electrodes is None:
+            nwbfile.electrodes = ElectrodeTable()
+        table = nwbfile.electrodes
+        if len(table) > 0:
+            raise ValueError("Electrodes already exist in current nwb file.")
+
+        n_electrodes = len(next(iter(columns.values())))
+        table.id.extend(np.arange(n_electrodes))
+        for name, values in columns.items():
+            if name in table.colnames:
+                table[name].extend(values)
+            else:
+                table.add_column(name=name, description=ELECTRODE_COLUMNS[name], data=values)
+
+    def get_ecephys_module(self, nwbfile: NWBFile):
+        """Returns the 'ecephys' processing module of nwbfile, created if needed."""
+        if 'ecephys' in nwbfile.processing:
+            return nwbfile.processing['ecephys']
+        return nwbfile.create_processing_module(
+            name='ecephys',
+            description='Processed extracellular electrophysiology data.'
+        )
+
+    def add_threshold_crossings(self, nwbfile: NWBFile, reader: RHDSessionReader, detector: ThresholdDetector,
+                                runs, sample_rate: float, channel_names: list, scaling: dict):
+        """Adds the crossings found by detector to nwbfile, as one SpikeEventSeries per channel.
+
+        The crossings are only known once reader has seen the whole session, so they are
+        written by hdmf after the data. Crossing times are taken from the runs of valid samples.
+        """
+        def get_times(channel):
+            samples, _ = detector.get_crossings(channel)
+            run = np.searchsorted(runs['stop_index'], samples, side='right')
+            return runs['start_time'][run] + (samples - runs['start_index'][run]) / sample_rate
+
+        def get_snippets(channel):
+            # (events, channels, samples), with the single channel of the series
+            return detector.get_crossings(channel)[1][:, None, :]
+
+        ecephys_module = self.get_ecephys_module(nwbfile)
+        for channel, channel_name in enumerate(channel_names):
+            ecephys_module.add(SpikeEventSeries(
+                name='ThresholdCrossings_' + channel_name,
+                description="Threshold crossings of channel {}, with the high-pass filtered waveform "
+                            "around each crossing.".format(channel_name),
+                data=RHDEventIterator(
+                    reader=reader,
+                    get_values=lambda channel=channel: get_snippets(channel),
+                    maxshape=(None, 1, detector.pre + detector.post),
+                    dtype=np.int16
+                ),
+                timestamps=RHDEventIterator(
+                    reader=reader,
+                    get_values=lambda channel=channel: get_times(channel),
+                    maxshape=(None,),
+                    dtype=np.float64
+                ),
+                electrodes=DynamicTableRegion(
+                    name='electrodes',
+                    data=[channel],
+                    description='electrode of the crossings',
+                    table=nwbfile.electrodes
+                ),
+                **scaling
+            ))
+
+    def add_qc_columns(self, nwbfile: NWBFile, reader: RHDSessionReader, channel_qc: ChannelQC, file_qc: str,
+                       channel_names: list):
+        """Adds the quality metrics of channel_qc as columns of the electrodes table.
+
+        The metrics are only known once reader has seen the whole session, so the columns are
+        written by hdmf after the data, together with the JSON summary in file_qc.
+        """
+        def get_values(name, save=False):
+            summary = channel_qc.get_summary()
+            if save:
+                channel_qc.save_summary(file_qc, channel_names=channel_names)
+                print("Saved ecephys quality metrics to {}".format(file_qc))
+            return summary[name]
+
+        for ii, (name, (dtype, description)) in enumerate(QC_METRICS.items()):
+            nwbfile.electrodes.add_column(
+                name=name,
+                description=description,
+                data=RHDSummaryIterator(
+                    reader=reader,
+                    get_values=lambda name=name, save=ii == 0: get_values(name, save),
+                    length=len(channel_names),
+                    dtype=dtype
+                )
+            )
+
+    def add_valid_runs(self, nwbfile: NWBFile, runs, sample_rate: float):
+        """Adds the runs of valid samples to nwbfile, as a table mapping written samples to acquisition time."""
+        valid_runs = TimeIntervals(
+            name='ecephys_valid_runs',
+            description='Runs of valid ecephys samples (board digital input 0 high) with contiguous '
+                        'timestamps. Samples start_index to stop_index - 1 of the ElectricalSeries data '
+                        'were acquired from start_time, one every 1 / rate seconds.'
+        )
+        valid_runs.add_column(name='start_index', description='Index of the first sample of the run in the data.')
+        valid_runs.add_column(name='stop_index', description='Index after the last sample of the run in the data.')
+        for run in runs:
+            valid_runs.add_interval(
+                start_time=float(run['start_time']),
+                stop_time=float(run['stop_timestamp'] + 1) / sample_rate,
+                start_index=int(run['start_index']),
+                stop_index=int(run['stop_index'])
+            )
+        nwbfile.add_time_intervals(valid_runs)
+
+    def add_digital_events(self, nwbfile: NWBFile, all_files: list):
+        """Adds the edges of the board digital inputs to nwbfile, as one TTLs table."""
+        print("Converting ecephys rhd digital inputs")
+        edges = get_digital_edges(all_files, stream='board_dig_in')
+        labels = list()
+        timestamps = list()
+        values = list()
+        for channel_name, line in edges.items():
+            for edge in ['rising', 'falling']:
+                timestamps.append(line[edge + '_times'])
+                values.append(np.full(len(line[edge + '_times']), len(labels)))
+                labels.append(channel_name + ' ' + edge)
+        if len(labels) == 0:
+            return
+
+        timestamps = np.concatenate(timestamps)
+        values = np.concatenate(values)
+        order = np.argsort(timestamps, kind='stable')
+        nwbfile.add_acquisition(TTLs(
+            name='TTLs_board_dig_in',
+            description='Rising and falling edges of the board digital inputs.',
+            timestamps=timestamps[order],
+            data=values[order],
+            labels=labels
+        ))
@@ -0,0 +1,434 @@
+from jaeger_lab_to_nwb.resources.load_intan.rhd_file import RHDFile
+from jaeger_lab_to_nwb.resources.load_intan.parallel_read import iter_read_data
+from jaeger_lab_to_nwb.resources.load_intan.read_data_blocks import to_signed_samples, get_stream_decimation
+from jaeger_lab_to_nwb.resources.load_intan.valid_runs import RUN_DTYPE, get_run_gaps
+from hdmf.data_utils import AbstractDataChunkIterator, DataChunkIterator, DataChunk
+import numpy as np
+import collections
+import tempfile
+import os
+
+
+class RHDSessionReader(object):
+    """Single pass over a session of rhd files, feeding one RHDDataChunkIterator per data array.
+
+    Each file is decoded once (one after another, or in worker processes, see iter_read_data),
+    and the arrays read_data returns under keys, e.g. 'amplifier_data', 'aux_input_data' or
+    't_amplifier', are split into pieces: one contiguous (time, channels) copy per run of
+    samples (see get_valid_runs), taken at the native rate of each stream. A file is decoded
+    when an iterator runs out of pieces; the pieces of the other arrays are queued in memory,
+    up to max_memory_mb per array, and spooled to temporary files beyond that. As hdmf writes
+    datasets one after another, every array is read from the rhd files only once, and no
+    array of the whole session is ever held in memory.
+
+    With compact=True, samples keep their native 16-bit width (see read_data), and the samples
+    of signed_keys (by default, the amplifier data) are turned into int16, with the 32768
+    offset removed.
+
+    Arrays derived from the pieces of another array in the same pass, e.g. filtered and
+    decimated amplifier data, are given as derived = {key: (source_key, transform)}. The
+    transform (e.g. a LFPFilter) is called on every piece of the source array, in order, and
+    its get_num_samples method gives the number of samples it yields for a number of samples
+    of the source array. Observers, given as [(source_key, observer)], are called on every
+    piece of the source array too, e.g. to accumulate statistics (see ChannelQC).
+
+    Transforms and observers with a reset method (e.g. LFPFilter, ThresholdDetector) are
+    reset before the first piece of each run that does not carry on the previous one in
+    acquisition time (see get_run_gaps), so that filters do not run through the gaps left by
+    invalid or missing samples. Runs only split by a file boundary keep their state. The
+    get_num_samples method of a transform with a reset method is then given the number of
+    samples of each segment of contiguous runs.
+
+    Example:
+    reader = RHDSessionReader(filenames, keys=['amplifier_data', 'aux_input_data'], runs=runs)
+    data = reader.get_iterator('amplifier_data')
+    aux_data = reader.get_iterator('aux_input_data')
+    """
+
+    def __init__(self, filenames, keys, runs=None, derived=None, observers=None, num_workers=1,
+                 max_pending_files=None, compact=False, signed_keys=('amplifier_data',), max_memory_mb=500.0,
+                 tmp_dir=None, print_progress=False):
+        self.filenames = [str(fname) for fname in filenames]
+        self.derived = dict() if derived is None else dict(derived)
+        self.observers = list() if observers is None else list(observers)
+        self.keys = list(keys) + [key for key in self.derived if key not in keys]
+        self.num_workers = num_workers
+        self.max_pending_files = max_pending_files
+        self.compact = compact
+        self.signed_keys = list(signed_keys)
+        self.print_progress = print_progress
+
+        with RHDFile(self.filenames[0]) as rhd:
+            self.header = rhd.header
+        if runs is None:
+            # Every sample of every file, as a single stream
+            segment_starts = np.zeros(len(self.filenames), dtype=bool)
+            runs = np.zeros(len(self.filenames), dtype=RUN_DTYPE)
+            runs['file_index'] = np.arange(len(self.filenames))
+            for file_index, fname in enumerate(self.filenames):
+                with RHDFile(fname) as rhd:
+                    runs['file_stop'][file_index] = rhd.num_samples
+            runs['num_samples'] = runs['file_stop']
+        else:
+            # Runs starting a new segment of contiguous timestamps, after a gap or reset
+            segment_starts = get_run_gaps(runs) != 0
+        self.runs = runs
+        self.segment_starts = segment_starts
+
+        # Stream of each array read from the files; the timestamps are part of every data block
+        self.read_keys = [key for key in self.keys if key not in self.derived]
+        for source, _ in list(self.derived.values()) + self.observers:
+            if source not in self.read_keys:
+                self.read_keys.append(source)
+        self.stream_names = {key: key[len('t_'):] if key.startswith('t_') else key[:-len('_data')]
+                             for key in self.read_keys}
+        self.streams = sorted(set(self.stream_names[key] for key in self.read_keys if not key.startswith('t_')))
+        self.decimations = {key: get_stream_decimation(self.stream_names[key], self.header) for key in self.read_keys}
+
+        self._queues = {key: _PieceQueue(max_memory_mb * 1e6, tmp_dir) for key in self.keys}
+        self._finished = set()
+        self._files_data = None
+        self._pending_resets = set()
+
+    def get_iterator(self, key, **kwargs):
+        """Returns the RHDDataChunkIterator of one of the keys."""
+        return RHDDataChunkIterator(key=key, reader=self, **kwargs)
+
+    def get_run_bounds(self, key):
+        """Returns the (start, stop) sample indices of the runs in their files, at the rate of key."""
+        decimation = self.decimations[key]
+        # Samples of a stream decimated by d are taken on amplifier samples 0, d, 2d...
+        return -(-self.runs['file_start'] // decimation), -(-self.runs['file_stop'] // decimation)
+
+    def get_num_samples(self, key):
+        """Total number of samples of key in the runs."""
+        if key in self.derived:
+            source, transform = self.derived[key]
+            if not hasattr(transform, 'reset'):
+                return int(transform.get_num_samples(self.get_num_samples(source)))
+            starts, stops = self.get_run_bounds(source)
+            segments = np.cumsum(self.segment_starts)
+            segment_samples = np.bincount(segments, weights=stops - starts).astype(np.int64)
+            return int(np.sum(transform.get_num_samples(segment_samples)))
+        starts, stops = self.get_run_bounds(key)
+        return int(np.sum(stops - starts))
+
+    def next_piece(self, key):
+        """Returns the next piece of key, decoding the next file if needed, or None at the end of the session."""
+        queue = self._queues[key]
+        while len(queue) == 0:
+            if not self._read_next_file(requester=key):
+                return None
+        return queue.pop()
+
+    def read_to_end(self):
+        """Decodes the remaining files, so that all observers have seen the whole session.
+
+        The pieces of the arrays that were not read yet are queued, spooled to temporary files
+        beyond max_memory_mb.
+        """
+        while self._read_next_file(requester=None):
+            pass
+
+    def finish(self, key):
+        """Marks key as fully read. The reader is closed once all keys are."""
+        self._finished.add(key)
+        if self._finished.issuperset(self.keys):
+            self.close()
+
+    def close(self):
+        """Removes the temporary files, and closes the observers that have a close method (see DatWriter)."""
+        if self._files_data is not None:
+            self._files_data.close()
+        for queue in self._queues.values():
+            queue.close()
+        for _, observer in self.observers:
+            if hasattr(observer, 'close'):
+                observer.close()
+
+    def _read_next_file(self, requester):
+        """Splits the next file into pieces. Pieces of the requester are always kept in memory."""
+        if self._files_data is None:
+            self._file_indices = np.unique(self.runs['file_index'])
+            self._files_data = iter_read_data(
+                [self.filenames[ii] for ii in self._file_indices],
+                num_workers=self.num_workers,
+                max_pending_files=self.max_pending_files,
+                keys=self.read_keys,
+                streams=self.streams,
+                compact=self.compact
+            )
+            self._file_count = 0
+        try:
+            fname, file_data = next(self._files_data)
+        except StopIteration:
+            return False
+        file_index = self._file_indices[self._file_count]
+        self._file_count += 1
+        if self.print_progress:
+            print("Converting ecephys rhd data: {}%".format(100 * file_index / len(self.filenames)))
+
+        in_file = self.runs['file_index'] == file_index
+        for key in self.read_keys:
+            if key not in file_data:
+                continue
+            data = file_data[key]
+            starts, stops = self.get_run_bounds(key)
+            for run_index in np.flatnonzero(in_file):
+                start, stop = starts[run_index], stops[run_index]
+                if self.segment_starts[run_index]:
+                    self._pending_resets.add(key)
+                if stop <= start:
+                    continue
+                # Transforms and observers of key start over at the first piece after a gap
+                reset = key in self._pending_resets
+                self._pending_resets.discard(key)
+                run_data = data[..., start:stop].T
+                if self.compact and key in self.signed_keys:
+                    piece = to_signed_samples(run_data, out=np.empty(run_data.shape, dtype=np.int16))
+                else:
+                    # Copied, as the arrays of iter_read_data may not outlive this file
+                    piece = np.array(run_data, order='C')
+                if key in self._queues:
+                    self._queues[key].push(piece, spill=key != requester)
+                for source, observer in self.observers:
+                    if source == key:
+                        if reset and hasattr(observer, 'reset'):
+                            observer.reset()
+                        observer(piece)
+                for derived_key, (source, transform) in self.derived.items():
+                    if source == key:
+                        if reset and hasattr(transform, 'reset'):
+                            transform.reset()
+                        derived_piece = np.ascontiguousarray(transform(piece))
+                        if derived_piece.shape[0] > 0:
+                            self._queues[derived_key].push(derived_piece, spill=derived_key != requester)
+        return True
+
+
+class _PieceQueue(object):
+    """FIFO of array pieces, kept in memory up to max_bytes and spooled to a temporary file beyond."""
+
+    def __init__(self, max_bytes, tmp_dir=None):
+        self.max_bytes = max_bytes
+        self.tmp_dir = tmp_dir
+        self.items = collections.deque()
+        self.nbytes = 0
+        self.spool = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def push(self, piece, spill=True):
+        if spill and self.nbytes + piece.nbytes > self.max_bytes:
+            if self.spool is None:
+                self.spool = tempfile.TemporaryFile(prefix='rhd_spool_', dir=self.tmp_dir)
+            offset = self.spool.seek(0, os.SEEK_END)
+            self.spool.write(memoryview(piece).cast('B'))
+            self.items.append((offset, piece.dtype, piece.shape))
+        else:
+            self.items.append(piece)
+            self.nbytes += piece.nbytes
+
+    def pop(self):
+        item = self.items.popleft()
+        if isinstance(item, np.ndarray):
+            self.nbytes -= item.nbytes
+            return item
+        offset, dtype, shape = item
+        piece = np.empty(shape, dtype=dtype)
+        self.spool.seek(offset)
+        self.spool.readinto(memoryview(piece).cast('B'))
+        return piece
+
+    def close(self):
+        self.items.clear()
+        self.nbytes = 0
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+
+class RHDDataChunkIterator(AbstractDataChunkIterator):
+    """Iterates over one data array of a session of rhd files in large blocks of contiguous samples.
+
+    The array read_data returns under key, of shape (channels, samples) or (samples,), is
+    yielded as (time, channels) DataChunks of buffer_size samples, carried on across file
+    boundaries. If a table of runs is given (see get_valid_runs), only the samples of those
+    runs are kept. DataChunks are views of the pieces of a RHDSessionReader, and only the
+    DataChunks spanning two pieces are copied.
+
+    The iterator reads the files itself, with the given runs, num_workers, max_pending_files,
+    compact and print_progress options (see RHDSessionReader), unless it is given the reader
+    it shares with the iterators of other arrays.
+
+    The total number of samples is known from the runs (or the headers) before iterating, so
+    the full data shape is known up front.
+    """
+
+    def __init__(self, filenames=None, key='amplifier_data', runs=None, reader=None, buffer_size=None,
+                 chunk_mb=1.0, buffer_mb=100.0, num_workers=1, max_pending_files=None, compact=False,
+                 print_progress=False):
+        if reader is None:
+            reader = RHDSessionReader(filenames, keys=[key], runs=runs, num_workers=num_workers,
+                                      max_pending_files=max_pending_files, compact=compact,
+                                      print_progress=print_progress)
+        self.reader = reader
+        self.key = key
+        self.num_samples = reader.get_num_samples(key)
+
+        self._piece = reader.next_piece(key)
+        if self._piece is None:
+            raise ValueError('No {} to iterate over in {} files.'.format(key, len(reader.filenames)))
+        self._dtype = self._piece.dtype
+        self._item_shape = self._piece.shape[1:]
+        self._position = 0
+
+        self._chunk_shape = self._get_chunk_shape(chunk_mb)
+        if buffer_size is None:
+            # Whole HDF5 chunks per buffer, so that writes stay aligned to chunk boundaries
+            row_bytes = self._dtype.itemsize * int(np.prod(self._item_shape))
+            num_chunks = max(1, int(buffer_mb * 1e6 // (row_bytes * self._chunk_shape[0])))
+            buffer_size = num_chunks * self._chunk_shape[0]
+        self.buffer_size = buffer_size
+
+    def _get_chunk_shape(self, chunk_mb):
+        """HDF5 chunk of about chunk_mb MB, spanning at most 64 channels."""
+        channels = tuple(min(n, 64) for n in self._item_shape)
+        row_bytes = self._dtype.itemsize * int(np.prod(channels))
+        num_rows = max(1, int(chunk_mb * 1e6 // row_bytes))
+        return (min(num_rows, max(self.num_samples, 1)),) + channels
+
+    def _take(self, num_rows):
+        """Takes up to num_rows rows from the current piece, moving on to the next piece when it is used up."""
+        rows = self._piece[:num_rows]
+        if rows.shape[0] < self._piece.shape[0]:
+            self._piece = self._piece[rows.shape[0]:]
+        else:
+            self._piece = self.reader.next_piece(self.key)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """Returns the next DataChunk of buffer_size samples (the last one may be shorter)."""
+        num_rows = min(self.buffer_size, self.num_samples - self._position)
+        if num_rows <= 0 or self._piece is None:
+            self.reader.finish(self.key)
+            raise StopIteration
+
+        if self._piece.shape[0] >= num_rows:
+            data = self._take(num_rows)
+        else:
+            data = np.empty((num_rows,) + self._item_shape, dtype=self._dtype)
+            filled = 0
+            while filled < num_rows and self._piece is not None:
+                rows = self._take(num_rows - filled)
+                data[filled:filled + rows.shape[0]] = rows
+                filled += rows.shape[0]
+            data = data[:filled]
+
+        start = self._position
+        self._position += data.shape[0]
+        selection = (slice(start, self._position),) + (slice(None),) * len(self._item_shape)
+        return DataChunk(data=data, selection=selection)
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return self._chunk_shape
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def maxshape(self):
+        return (self.num_samples,) + self._item_shape
+
+
+class RHDSummaryIterator(AbstractDataChunkIterator):
+    """Iterates over values computed from a whole session, e.g. by a ChannelQC observer of a RHDSessionReader.
+
+    hdmf writes data chunk iterators after the rest of the file, so the values are only
+    computed when they are written, by get_values, once the reader has seen the whole session
+    (see RHDSessionReader.read_to_end). As the length of the values is known up front, they
+    can be given as a column of a table, e.g. the electrodes table.
+    """
+
+    def __init__(self, reader, get_values, length, dtype):
+        self.reader = reader
+        self.get_values = get_values
+        self.length = length
+        self._dtype = np.dtype(dtype)
+        self._done = False
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        self._done = True
+        self.reader.read_to_end()
+        values = np.asarray(self.get_values(), dtype=self._dtype)
+        if values.shape != (self.length,):
+            raise ValueError('Expected {} values, got an array of shape {}.'.format(self.length, values.shape))
+        return DataChunk(data=values, selection=np.s_[:self.length])
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return None
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def maxshape(self):
+        return (self.length,)
+
+
+class RHDEventIterator(DataChunkIterator):
+    """Iterates over values of unknown length computed from a whole session, e.g. threshold crossings.
+
+    As with RHDSummaryIterator, the values are only computed when hdmf writes them, once the
+    reader has seen the whole session, and their dataset grows from an empty one. Being a
+    DataChunkIterator, it can be given as both data and timestamps of a time series whose
+    length is unknown up front.
+    """
+
+    def __init__(self, reader, get_values, maxshape, dtype):
+        super().__init__(data=None, maxshape=tuple(maxshape), dtype=np.dtype(dtype))
+        self.reader = reader
+        self.get_values = get_values
+        self._done = False
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        self._done = True
+        self.reader.read_to_end()
+        values = np.asarray(self.get_values(), dtype=self.dtype)
+        if values.shape[0] == 0:
+            raise StopIteration
+        return DataChunk(data=values, selection=(slice(0, values.shape[0]),) + (slice(None),) * (values.ndim - 1))
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return None
+
+    def recommended_data_shape(self):
+        return (0,) + tuple(self.maxshape[1:])
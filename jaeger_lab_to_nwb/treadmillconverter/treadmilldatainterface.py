@@ -2,6 +2,8 @@ from nwb_conversion_tools.basedatainterface import BaseDataInterface
 from nwb_conversion_tools.utils import get_schema_from_hdmf_class
 from nwb_conversion_tools.json_schema_utils import get_base_schema
 
+from jaeger_lab_to_nwb.resources.write_options import get_write_options_schema, get_write_options, wrap_data
+
 from pynwb import NWBFile, TimeSeries
 from datetime import datetime
 from pathlib import Path
@@ -31,6 +33,13 @@ class TreadmillDataInterface(BaseDataInterface):
 
     def get_metadata_schema(self):
         metadata_schema = super().get_metadata_schema()
+
+        # Write options schema
+        metadata_schema['properties']['WriteOptions'] = get_base_schema()
+        metadata_schema['properties']['WriteOptions']['properties'] = {
+            'default': get_write_options_schema(),
+            self.__class__.__name__: get_write_options_schema()
+        }
         return metadata_schema
 
     def get_metadata(self):
@@ -49,7 +58,7 @@ class TreadmillDataInterface(BaseDataInterface):
         )
         return metadata
 
-    def run_conversion(self, nwbfile: NWBFile, metadata: dict):
+    def run_conversion(self, nwbfile: NWBFile, metadata: dict, write_options: dict = None):
         """
         Run conversion for this data interface.
         Reads treadmill experiment behavioral data from csv files and adds it to nwbfile.
@@ -58,7 +67,13 @@ class TreadmillDataInterface(BaseDataInterface):
         ----------
         nwbfile : NWBFile
         metadata : dict
+        write_options : dict, optional
+            HDF5 chunking and compression options of the behavioral time series, with keys chunk_shape,
+            compression ('gzip', 'lzf' or 'blosc'), compression_opts, shuffle and blosc_codec.
+            Overrides the options found in metadata['WriteOptions'].
         """
+        write_options = get_write_options(metadata, self.__class__.__name__, write_options)
+
         # Detect relevant files: trials summary, treadmill data and nose data
         dir_behavior_treadmill = self.source_data['dir_behavior_treadmill']
         trials_file = [f for f in Path(dir_behavior_treadmill).glob('*_tr.csv') if '~lock' not in f.name][0]
@@ -121,7 +136,7 @@ class TreadmillDataInterface(BaseDataInterface):
         for meta in meta_behavioral_ts.values():
             ts = TimeSeries(
                 name=meta['name'],
-                data=df_all[meta['name']].to_numpy(),
+                data=wrap_data(df_all[meta['name']].to_numpy(), write_options),
                 timestamps=df_all['Time'].to_numpy() - t_offset,
                 description=meta['description']
             )